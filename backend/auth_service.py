@@ -3,13 +3,60 @@
 
 from __future__ import annotations
 
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 import bcrypt
+from cachetools import TTLCache
 from psycopg.errors import UniqueViolation
+from psycopg.rows import tuple_row
 
 from .models import User
-from .utils.db import get_connection
+from .utils.db import get_async_connection, get_connection
+
+logger = logging.getLogger(__name__)
+
+# Cost factor for new hashes. Stored hashes with a different cost are
+# re-hashed transparently on the next successful sign-in.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+
+# bcrypt is CPU-bound and releases the GIL, so hashing runs on a dedicated pool
+# sized to the CPU count instead of blocking the event loop.
+_bcrypt_executor = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1, thread_name_prefix="bcrypt"
+)
+
+# Recently verified (password_hash, HMAC(password)) pairs. The HMAC key is
+# random per process so cached digests are useless outside this worker.
+_VERIFY_CACHE_KEY = secrets.token_bytes(32)
+_verify_cache: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+
+# Strong references to in-flight re-hashes until their callback has run
+_rehash_futures: set[asyncio.Future] = set()
+
+_USERNAME_TRANS = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Salts are cut from a batch of OS entropy (one getrandom call per
+# _SALT_BATCH salts) and encoded with bcrypt's base64 alphabet.
+_SALT_BYTES = 16
+_SALT_BATCH = 64
+_BCRYPT_B64 = bytes.maketrans(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/",
+    b"./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789",
+)
+_salt_entropy = b""
+_salt_offset = 0
+_salt_lock = threading.Lock()
 
 
 class AuthenticationError(Exception):
@@ -24,11 +71,26 @@ class UserAlreadyExistsError(AuthenticationError):
     """Raised when attempting to register a duplicate username."""
 
 
+def _gensalt() -> bytes:
+    """Equivalent of bcrypt.gensalt(BCRYPT_ROUNDS) using batched entropy."""
+    global _salt_entropy, _salt_offset
+
+    with _salt_lock:
+        if _salt_offset >= len(_salt_entropy):
+            _salt_entropy = secrets.token_bytes(_SALT_BYTES * _SALT_BATCH)
+            _salt_offset = 0
+        raw = _salt_entropy[_salt_offset:_salt_offset + _SALT_BYTES]
+        _salt_offset += _SALT_BYTES
+
+    encoded = base64.b64encode(raw)[:22].translate(_BCRYPT_B64)
+    return b"$2b$%02d$" % BCRYPT_ROUNDS + encoded
+
+
 def _hash_password(password: str) -> str:
     """Hash a password using bcrypt."""
     # Convert password to bytes and hash it
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = _gensalt()
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
@@ -40,6 +102,45 @@ def _verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password_bytes, hashed_bytes)
 
 
+def _needs_rehash(hashed: str) -> bool:
+    """Return True if a stored hash was made with a different cost factor."""
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+def _rehash_password(user_id: int, password: str) -> None:
+    """Re-hash a password at the current cost factor and store it."""
+    hashed_password = _hash_password(password)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE users SET password_hash = %s WHERE id = %s",
+                (hashed_password, user_id),
+            )
+
+
+def _rehash_done(user_id: int, future: asyncio.Future) -> None:
+    """Drop a finished re-hash and log it if it failed."""
+    _rehash_futures.discard(future)
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.warning("Failed to rehash password for user %s: %s", user_id, error)
+
+
+# Verified against when the username does not exist, so unknown and known
+# usernames take the same bcrypt time and cannot be told apart by latency.
+_DUMMY_HASH = _hash_password(secrets.token_urlsafe(16))
+
+
+def _password_digest(password: str) -> bytes:
+    """Keyed digest of a password, used only as a verification cache key."""
+    return hmac.new(_VERIFY_CACHE_KEY, password.encode("utf-8"), hashlib.sha256).digest()
+
+
 def _row_to_user(row: dict) -> User:
     return User(
         id=row["id"],
@@ -50,19 +151,28 @@ def _row_to_user(row: dict) -> User:
 
 
 def _normalize_username(username: str) -> str:
+    # str.translate lowercases ASCII in a single C pass; non-ASCII names keep
+    # full Unicode lowercasing.
+    if username.isascii():
+        return username.translate(_USERNAME_TRANS).strip()
     return username.strip().lower()
 
 
-def register_user(username: str, password: str, full_name: Optional[str] = None) -> User:
+async def register_user(
+    username: str, password: str, full_name: Optional[str] = None
+) -> User:
     """Create a new user record."""
 
-    hashed_password = _hash_password(password)
+    loop = asyncio.get_running_loop()
+    hashed_password = await loop.run_in_executor(
+        _bcrypt_executor, _hash_password, password
+    )
     normalized_username = _normalize_username(username)
 
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
+        async with get_async_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
                     """
                     INSERT INTO users (username, full_name, password_hash)
                     VALUES (%s, %s, %s)
@@ -70,7 +180,7 @@ def register_user(username: str, password: str, full_name: Optional[str] = None)
                     """,
                     (normalized_username, full_name, hashed_password),
                 )
-                row = cur.fetchone()
+                row = await cur.fetchone()
     except UniqueViolation as exc:
         raise UserAlreadyExistsError("Username already exists") from exc
 
@@ -79,27 +189,53 @@ def register_user(username: str, password: str, full_name: Optional[str] = None)
     return _row_to_user(row)
 
 
-def authenticate_user(username: str, password: str) -> User:
+async def authenticate_user(username: str, password: str) -> User:
     """Validate provided credentials and return the associated user."""
 
     normalized_username = _normalize_username(username)
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor(row_factory=tuple_row) as cur:
+            await cur.execute(
                 """
                 SELECT id, username, full_name, password_hash, created_at
                 FROM users
                 WHERE username = %s
                 """,
                 (normalized_username,),
+                prepare=True,
             )
-            row = cur.fetchone()
+            row = await cur.fetchone()
 
     if not row:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            _bcrypt_executor, _verify_password, password, _DUMMY_HASH
+        )
         raise InvalidCredentialsError("Invalid username or password")
 
-    if not _verify_password(password, row["password_hash"]):
-        raise InvalidCredentialsError("Invalid username or password")
-
-    return _row_to_user(row)
+    user_id, db_username, full_name, password_hash, created_at = row
+
+    cache_key = (password_hash, _password_digest(password))
+    if cache_key not in _verify_cache:
+        loop = asyncio.get_running_loop()
+        password_ok = await loop.run_in_executor(
+            _bcrypt_executor, _verify_password, password, password_hash
+        )
+        if not password_ok:
+            raise InvalidCredentialsError("Invalid username or password")
+        _verify_cache[cache_key] = True
+
+        if _needs_rehash(password_hash):
+            # Fire and forget: the caller does not wait for the upgrade
+            future = loop.run_in_executor(
+                _bcrypt_executor, _rehash_password, user_id, password
+            )
+            _rehash_futures.add(future)
+            future.add_done_callback(functools.partial(_rehash_done, user_id))
 
+    return User(
+        id=user_id,
+        username=db_username,
+        full_name=full_name,
+        created_at=created_at,
+    )
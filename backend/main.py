@@ -1,14 +1,11 @@
-"""Entrypoint for running the FastAPI server."""
+"""Entrypoint for running the FastAPI server.
 
-import sys
-from pathlib import Path
+Run from the project root so ``backend`` resolves as a package:
 
-# Add project root to path so imports work when running from backend/
-project_root = Path(__file__).parent.parent
-if str(project_root) not in sys.path:
-    sys.path.insert(0, str(project_root))
+    python -m backend.main
+"""
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("backend.server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("backend.server:app", host="0.0.0.0", port=8000, reload=True)
@@ -3,10 +3,16 @@
 from datetime import datetime
 from typing import Dict, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
 
 
-class SignupRequest(BaseModel):
+class FrozenModel(BaseModel):
+    """Immutable base model; instances are never mutated after validation."""
+
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
+
+class SignupRequest(FrozenModel):
     """Payload for registering a new user."""
 
     username: str = Field(..., min_length=3, max_length=64)
@@ -14,14 +20,14 @@ class SignupRequest(BaseModel):
     full_name: Optional[str] = Field(default=None, max_length=128)
 
 
-class SigninRequest(BaseModel):
+class SigninRequest(FrozenModel):
     """Payload for authenticating an existing user."""
 
     username: str
     password: str
 
 
-class User(BaseModel):
+class User(FrozenModel):
     """User representation returned to clients."""
 
     id: int
@@ -30,14 +36,14 @@ class User(BaseModel):
     created_at: Optional[datetime] = None
 
 
-class AuthResponse(BaseModel):
+class AuthResponse(FrozenModel):
     """Standard response for signup/signin APIs."""
 
     message: str
     user: Optional[User] = None
 
 
-class FileRecord(BaseModel):
+class FileRecord(FrozenModel):
     """File record representation."""
 
     id: int
@@ -51,21 +57,56 @@ class FileRecord(BaseModel):
     created_at: Optional[datetime] = None
 
 
-class FileUploadResponse(BaseModel):
+# Validates a whole list of file rows in one pass of pydantic-core
+FILE_RECORD_LIST_ADAPTER = TypeAdapter(list[FileRecord])
+
+
+class FileUploadResponse(FrozenModel):
     """Response after file upload request."""
 
     message: str
     files: list[FileRecord]
 
 
-class RAGQueryRequest(BaseModel):
+class DirectUploadFile(FrozenModel):
+    """A file the client will PUT straight to S3."""
+
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str
+    file_size: int = Field(..., gt=0)
+
+
+class DirectUploadRequest(FrozenModel):
+    """Request to register files for direct-to-S3 upload."""
+
+    files: list[DirectUploadFile] = Field(..., min_length=1)
+
+
+class PresignedUpload(FrozenModel):
+    """Where and how to PUT one file."""
+
+    file_id: int
+    filename: str
+    put_url: str
+    content_type: str
+    expires_in: int
+
+
+class DirectUploadResponse(FrozenModel):
+    """Presigned PUT URLs for newly created file records."""
+
+    message: str
+    uploads: list[PresignedUpload]
+
+
+class RAGQueryRequest(FrozenModel):
     """Request for RAG query."""
 
     query: str = Field(..., min_length=1, description="Question or query about patient records")
     top_k: int = Field(default=5, ge=1, le=20, description="Number of chunks to retrieve")
 
 
-class Source(BaseModel):
+class Source(FrozenModel):
     """Source document information."""
 
     filename: str
@@ -74,7 +115,7 @@ class Source(BaseModel):
     chunk_index: int
 
 
-class RAGQueryResponse(BaseModel):
+class RAGQueryResponse(FrozenModel):
     """Response from RAG query."""
 
     query: str
@@ -83,7 +124,7 @@ class RAGQueryResponse(BaseModel):
     num_chunks_found: int
 
 
-class SummaryRequest(BaseModel):
+class SummaryRequest(FrozenModel):
     """Request for patient summary generation."""
 
     specialist_type: str = Field(
@@ -100,7 +141,7 @@ class SummaryRequest(BaseModel):
     )
 
 
-class SummaryResponse(BaseModel):
+class SummaryResponse(FrozenModel):
     """Response with patient health summary."""
 
     summary: str
@@ -108,10 +149,26 @@ class SummaryResponse(BaseModel):
     sources: list[Source]
     specialist_type: str
     num_sources: int = 0
+    num_tokens_in: Optional[int] = None
     note: Optional[str] = None
 
 
-class SummaryPdfResponse(BaseModel):
+class SummaryBatchRequest(FrozenModel):
+    """Request to pre-generate summaries for several patients in one OpenAI batch."""
+
+    patient_ids: list[int] = Field(..., min_length=1)
+    specialist_type: str = Field(default="general")
+
+
+class SummaryBatchResponse(FrozenModel):
+    """Status of a summary batch."""
+
+    batch_id: Optional[str] = None
+    status: str
+    message: str
+
+
+class SummaryPdfResponse(FrozenModel):
     """Response with summary PDF information."""
 
     summary_id: int
@@ -1,41 +1,127 @@
 """FastAPI server exposing HTTP APIs only."""
 
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import datetime
 from typing import List, Optional
 
-from fastapi import BackgroundTasks, Depends, FastAPI, File, Form, HTTPException, UploadFile, status
+from cachetools import TTLCache
+from psycopg.rows import tuple_row
+
+from fastapi import BackgroundTasks, Depends, FastAPI, File, Form, HTTPException, Query, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 
 from . import auth_service
 from .models import (
+    FILE_RECORD_LIST_ADAPTER,
     AuthResponse,
+    DirectUploadRequest,
+    DirectUploadResponse,
     FileRecord,
     FileUploadResponse,
+    PresignedUpload,
     RAGQueryRequest,
     RAGQueryResponse,
     SigninRequest,
     SignupRequest,
+    Source,
+    SummaryBatchRequest,
+    SummaryBatchResponse,
     SummaryRequest,
     SummaryResponse,
     SummaryPdfResponse,
 )
-from .services import file_service, pathway_rag_service, summary_service, orchestration_service
-
-
-app = FastAPI(title="Patient Summary Backend", version="0.1.0")
+from .services import (
+    file_service,
+    orchestration_service,
+    pathway_rag_service,
+    pathway_service,
+    summary_batch_service,
+    summary_service,
+)
+from .services.summary_service import SPECIALISTS
+from .utils import db, s3_client
+from .utils.db import get_async_connection
+from .utils.logging_config import configure_logging
+from .utils.s3_client import PRESIGNED_URL_EXPIRES_IN, generate_presigned_put_url
+
+
+# MIME type -> stored file type; its keys are the allowed upload types
+_MIME_TO_TYPE = file_service._FILE_TYPE_MAPPING
+_ALLOWED_TYPES = frozenset(_MIME_TO_TYPE)
+_MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB limit
+
+# Uploads are copied into spooled files that stay in memory up to this size
+# and roll over to disk beyond it.
+_SPOOL_MAX_MEMORY = 1024 * 1024
+_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# username -> user id. Usernames never change owner, so hits skip the DB;
+# unknown usernames are not cached.
+_USER_ID_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=600)
+_USER_ID_LOCK = threading.Lock()
+
+# Comma-separated origins allowed to call the API from a browser
+# (defaults to the Vite dev server)
+ALLOWED_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv(
+        "ALLOWED_ORIGINS", "http://localhost:5173,http://127.0.0.1:5173"
+    ).split(",")
+    if origin.strip()
+]
+
+configure_logging()
+
+app = FastAPI(
+    title="Patient Summary Backend",
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
 )
 
 
+@app.on_event("startup")
+async def open_db_pools() -> None:
+    # Warm the pools so the first requests do not pay for connection setup
+    await db.open_pools()
+
+
+@app.on_event("shutdown")
+async def close_db_pools() -> None:
+    await db.close_pools()
+
+
+@app.on_event("shutdown")
+async def stop_summary_pdf_executor() -> None:
+    await asyncio.to_thread(orchestration_service.shutdown_executor)
+
+
+@app.on_event("shutdown")
+async def stop_parse_workers() -> None:
+    await asyncio.to_thread(pathway_service.shutdown_executor)
+
+
+@app.on_event("shutdown")
+async def stop_s3_executor() -> None:
+    await asyncio.to_thread(s3_client.shutdown_executor)
+
+
 @app.post("/auth/signup", response_model=AuthResponse, tags=["auth"])
 async def signup(payload: SignupRequest) -> AuthResponse:
     try:
-        user = auth_service.register_user(
+        user = await auth_service.register_user(
             username=payload.username,
             password=payload.password,
             full_name=payload.full_name,
@@ -56,7 +142,7 @@ async def signup(payload: SignupRequest) -> AuthResponse:
 @app.post("/auth/signin", response_model=AuthResponse, tags=["auth"])
 async def signin(payload: SigninRequest) -> AuthResponse:
     try:
-        user = auth_service.authenticate_user(
+        user = await auth_service.authenticate_user(
             username=payload.username, password=payload.password
         )
         return AuthResponse(message="Login successful", user=user)
@@ -72,26 +158,120 @@ async def healthcheck() -> dict[str, str]:
     return {"status": "ok"}
 
 
-def get_user_id_from_username(username: str) -> int:
+async def get_user_id_from_username(username: str) -> int:
     """
     Get user ID from username and verify user exists.
     Returns user_id if found, raises 404 if not found.
     """
-    from .utils.db import get_connection
-
     # Normalize username (lowercase, trimmed)
-    normalized_username = username.strip().lower()
-
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username = %s", (normalized_username,))
-            row = cur.fetchone()
+    normalized_username = auth_service._normalize_username(username)
+
+    with _USER_ID_LOCK:
+        user_id = _USER_ID_CACHE.get(normalized_username)
+    if user_id is not None:
+        return user_id
+
+    async with get_async_connection() as conn:
+        async with conn.cursor(row_factory=tuple_row) as cur:
+            await cur.execute(
+                "SELECT id FROM users WHERE username = %s",
+                (normalized_username,),
+                prepare=True,
+            )
+            row = await cur.fetchone()
             if not row:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"User with username '{username}' not found",
                 )
-            return row["id"]
+
+    _remember_user_id(normalized_username, row[0])
+    return row[0]
+
+
+def _remember_user_id(normalized_username: str, user_id: int) -> None:
+    """Cache a username -> user id mapping resolved by any query."""
+    with _USER_ID_LOCK:
+        _USER_ID_CACHE[normalized_username] = user_id
+
+
+def _invalidate_user(username: str) -> None:
+    """Drop a cached username -> user id mapping (e.g. after account deletion)."""
+    with _USER_ID_LOCK:
+        _USER_ID_CACHE.pop(auth_service._normalize_username(username), None)
+
+
+def _to_sources(raw_sources: List[dict]) -> List[Source]:
+    """
+    Convert source dicts from the RAG/summary services to response models.
+    The dicts are built by our own services, so validation is skipped.
+    """
+    return [
+        Source.model_construct(
+            filename=s["filename"],
+            file_id=s["file_id"],
+            s3_url=s.get("s3_url"),
+            chunk_index=s["chunk_index"],
+        )
+        for s in raw_sources
+    ]
+
+
+async def _prepare_one(file: UploadFile) -> tuple[tuple, tempfile.SpooledTemporaryFile, str]:
+    """
+    Validate one upload and copy it into a spool, hashing it on the way.
+
+    Returns:
+        (file spec for create_file_records, spool positioned at 0, content type)
+    """
+    # Validate file type
+    ct = (file.content_type or "").lower()
+    if ct not in _ALLOWED_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid file type: {file.content_type}. Allowed: JPEG, PNG, PDF",
+        )
+
+    # Reject oversized files up front when the multipart parser knows the size
+    if file.size is not None and file.size > _MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File {file.filename} exceeds maximum size of 50MB",
+        )
+
+    # Copy the upload into a spool we own (FastAPI closes UploadFile once
+    # the response is sent, before background tasks run)
+    # Size check, SHA-256 and spooling share a single pass over the bytes;
+    # the rolling size check is only needed when the size wasn't known
+    spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_MEMORY)
+    digest = hashlib.sha256()
+    file_size = 0
+    try:
+        while chunk := await file.read(_UPLOAD_CHUNK_SIZE):
+            if file.size is None:
+                file_size += len(chunk)
+                # Validate file size
+                if file_size > _MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"File {file.filename} exceeds maximum size of 50MB",
+                    )
+            digest.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        # The caller only gets the spool back on success
+        spool.close()
+        raise
+    if file.size is not None:
+        file_size = file.size
+    spool.seek(0)
+
+    # Normalize file type
+    file_type = _MIME_TO_TYPE[ct]
+    content_type = file.content_type or "application/octet-stream"
+    filename = file.filename or "unknown"
+
+    return (filename, file_type, file_size, digest.hexdigest()), spool, content_type
 
 
 @app.post(
@@ -118,64 +298,58 @@ async def upload_files(
         specialist_type: Type of specialist (dermatologist, ophthalmologist, etc.)
         custom_prompt: Optional custom prompt for summary generation (overrides specialist_type focus)
     """
-    # Get user_id from username
-    patient_id = get_user_id_from_username(username)
-    
     # Validate specialist type (only if custom_prompt is not provided)
     if not custom_prompt:
-        from .services.summary_service import get_available_specialists
-        available_specialists = get_available_specialists()
-        if specialist_type.lower() not in available_specialists:
+        if specialist_type.lower() not in SPECIALISTS:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid specialist_type: {specialist_type}. Available: {', '.join(available_specialists)}",
+                detail=f"Invalid specialist_type: {specialist_type}. Available: {', '.join(summary_service.get_available_specialists())}",
             )
     
-    # Allowed file types
-    allowed_types = {"image/jpeg", "image/jpg", "image/png", "application/pdf"}
-    max_file_size = 50 * 1024 * 1024  # 50MB limit
+    # Validate and spool all files concurrently
+    prepared = await asyncio.gather(
+        *(_prepare_one(file) for file in files), return_exceptions=True
+    )
+    errors = [p for p in prepared if isinstance(p, BaseException)]
+    if errors:
+        for p in prepared:
+            if not isinstance(p, BaseException):
+                p[1].close()
+        raise errors[0]
+
+    file_specs = [spec for spec, _, _ in prepared]
+    uploads = [(spool, content_type) for _, spool, content_type in prepared]
+
+    # Resolve the user and create all file records plus the summary PDF
+    # record in one round trip
+    try:
+        created_records, summary_record = await orchestration_service.create_upload_batch(
+            auth_service._normalize_username(username), file_specs, specialist_type.lower()
+        )
+    except BaseException:
+        # No upload task owns the spools yet
+        for spool, _ in uploads:
+            spool.close()
+        raise
+    if not created_records:
+        for spool, _ in uploads:
+            spool.close()
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"User with username '{username}' not found",
+        )
+    patient_id = created_records[0]["patient_id"]
 
     file_records = []
     file_ids = []
 
-    for file in files:
-        # Validate file type
-        if not file.content_type or file.content_type.lower() not in allowed_types:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid file type: {file.content_type}. Allowed: JPEG, PNG, PDF",
-            )
-
-        # Read file content (needed for size check and upload)
-        file_content = await file.read()
-        file_size = len(file_content)
-
-        # Validate file size
-        if file_size > max_file_size:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"File {file.filename} exceeds maximum size of 50MB",
-            )
-
-        # Normalize file type
-        file_type = file_service._normalize_file_type(file.content_type)
-        content_type = file.content_type or "application/octet-stream"
-        filename = file.filename or "unknown"
-
-        # Create file record in database immediately
-        file_record = file_service.create_file_record(
-            patient_id=patient_id,
-            filename=filename,
-            file_type=file_type,
-            file_size=file_size,
-        )
-
-        # Queue async S3 upload (pass file content as bytes, not file object)
-        background_tasks.add_task(
-            file_service.upload_file_to_s3_async,
-            file_content=file_content,
-            filename=filename,
+    for file_record, (spool, content_type) in zip(created_records, uploads):
+        # Start async S3 upload (the task streams and then closes the spool)
+        file_service.schedule_upload_to_s3(
+            fileobj=spool,
+            filename=file_record["filename"],
             content_type=content_type,
+            file_type=file_record["file_type"],
             file_id=file_record["id"],
             patient_id=patient_id,
         )
@@ -194,12 +368,6 @@ async def upload_files(
         )
         file_ids.append(file_record["id"])
 
-    # Create summary PDF record and trigger end-to-end processing
-    summary_record = orchestration_service.create_summary_pdf_record(
-        patient_id=patient_id,
-        specialist_type=specialist_type.lower(),
-        file_ids=file_ids,
-    )
     summary_id = summary_record["id"]
     
     # Trigger end-to-end pipeline in background
@@ -210,6 +378,7 @@ async def upload_files(
         specialist_type=specialist_type.lower(),
         summary_id=summary_id,
         custom_prompt=custom_prompt,
+        patient_name=summary_record["patient_name"],
     )
 
     return FileUploadResponse(
@@ -218,28 +387,133 @@ async def upload_files(
     )
 
 
-@app.get("/users/{username}/files", tags=["files"])
-async def get_user_files(
+@app.post(
+    "/users/{username}/files/initiate",
+    response_model=DirectUploadResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["files"],
+)
+async def initiate_direct_upload(
     username: str,
-) -> List[FileRecord]:
-    """Get all files for a user."""
-    # Get user_id from username
-    patient_id = get_user_id_from_username(username)
-    files = file_service.get_patient_files(patient_id)
-    return [
-        FileRecord(
-            id=f["id"],
-            patient_id=patient_id,
-            filename=f["filename"],
-            file_type=f["file_type"],
-            file_size=f["file_size"],
-            s3_url=f.get("s3_url"),
-            upload_status=f["upload_status"],
-            extraction_status=f["extraction_status"],
-            created_at=f["created_at"],
+    payload: DirectUploadRequest,
+) -> DirectUploadResponse:
+    """
+    Register files for direct upload and return a presigned PUT URL for each.
+    The client PUTs every file to its URL (with the declared Content-Type and
+    size), then calls /users/{username}/files/{file_id}/complete.
+    """
+    for f in payload.files:
+        if f.content_type.lower() not in _ALLOWED_TYPES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid file type: {f.content_type}. Allowed: JPEG, PNG, PDF",
+            )
+        if f.file_size > _MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File {f.filename} exceeds maximum size of 50MB",
+            )
+
+    # The content never passes through the server, so its hash is unknown;
+    # summary PDF reuse falls back to keying these files by id and update time
+    file_specs = [
+        (f.filename, _MIME_TO_TYPE[f.content_type.lower()], f.file_size, None)
+        for f in payload.files
+    ]
+    created_records = await file_service.create_file_records(
+        auth_service._normalize_username(username), file_specs
+    )
+    if not created_records:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"User with username '{username}' not found",
         )
-        for f in files
+    patient_id = created_records[0]["patient_id"]
+
+    s3_keys = await file_service.assign_s3_keys(patient_id, created_records)
+
+    uploads = [
+        PresignedUpload(
+            file_id=record["id"],
+            filename=record["filename"],
+            put_url=generate_presigned_put_url(s3_key, f.content_type, f.file_size),
+            content_type=f.content_type,
+            expires_in=PRESIGNED_URL_EXPIRES_IN,
+        )
+        for record, s3_key, f in zip(created_records, s3_keys, payload.files)
     ]
+    return DirectUploadResponse(
+        message=f"Created {len(uploads)} upload URL(s)",
+        uploads=uploads,
+    )
+
+
+@app.post(
+    "/users/{username}/files/{file_id}/complete",
+    response_model=FileRecord,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["files"],
+)
+async def complete_direct_upload(username: str, file_id: int) -> FileRecord:
+    """
+    Mark a directly uploaded file as uploaded and queue text extraction.
+    """
+    patient_id = await get_user_id_from_username(username)
+
+    file_record = await file_service.get_file_by_id(file_id)
+    if not file_record or file_record["patient_id"] != patient_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"File {file_id} not found",
+        )
+
+    if file_record["upload_status"] == "uploading":
+        s3_url = await file_service.complete_direct_upload(file_record)
+        if s3_url is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"File {file_id} has not been uploaded to S3 yet",
+            )
+        file_record = {**file_record, "s3_url": s3_url, "upload_status": "completed"}
+    elif file_record["upload_status"] != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"File {file_id} is not awaiting a direct upload",
+        )
+
+    return FileRecord.model_validate(file_record)
+
+
+@app.get("/users/{username}/files", response_model=List[FileRecord], tags=["files"])
+async def get_user_files(
+    username: str,
+    limit: int = Query(default=100, ge=1, le=500),
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+) -> Response:
+    """
+    Get a user's files, newest first.
+    Pass the created_at and id of the last file as `before` / `before_id`
+    to fetch the next page.
+    """
+    # Resolve the user and list files in one query
+    normalized_username = auth_service._normalize_username(username)
+    patient_id, files = await file_service.get_files_by_username(
+        normalized_username, limit=limit, before=before, before_id=before_id
+    )
+    if patient_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"User with username '{username}' not found",
+        )
+    _remember_user_id(normalized_username, patient_id)
+    # Validate and serialize the whole list in pydantic-core, skipping
+    # FastAPI's per-item response_model pass and jsonable_encoder
+    records = FILE_RECORD_LIST_ADAPTER.validate_python(files)
+    return Response(
+        content=FILE_RECORD_LIST_ADAPTER.dump_json(records),
+        media_type="application/json",
+    )
 
 
 @app.post(
@@ -256,7 +530,7 @@ async def query_patient_records(
     Searches through all indexed documents for the patient and returns relevant information.
     """
     # Get user_id from username
-    patient_id = get_user_id_from_username(username)
+    patient_id = await get_user_id_from_username(username)
     
     # Query RAG pipeline
     result = await pathway_rag_service.query_rag(
@@ -266,16 +540,7 @@ async def query_patient_records(
     )
     
     # Convert sources to response model
-    from .models import Source
-    sources = [
-        Source(
-            filename=s["filename"],
-            file_id=s["file_id"],
-            s3_url=s.get("s3_url"),
-            chunk_index=s["chunk_index"],
-        )
-        for s in result["sources"]
-    ]
+    sources = _to_sources(result["sources"])
     
     return RAGQueryResponse(
         query=result["query"],
@@ -294,7 +559,7 @@ async def get_patient_documents(
     Returns summary of documents stored in Pathway index.
     """
     # Get user_id from username
-    patient_id = get_user_id_from_username(username)
+    patient_id = await get_user_id_from_username(username)
     
     documents = pathway_rag_service.get_patient_documents(patient_id)
     
@@ -336,27 +601,24 @@ async def generate_patient_summary(
     All information is traceable to source documents with citations.
     """
     # Get user_id from username
-    patient_id = get_user_id_from_username(username)
+    patient_id = await get_user_id_from_username(username)
+    
+    # Standard summaries may already have been written by a batch run
+    result = None
+    if not request.custom_query and not request.custom_prompt:
+        result = await summary_batch_service.get_batch_summary(patient_id, request.specialist_type)
     
     # Generate summary
-    result = await summary_service.generate_patient_summary(
-        patient_id=patient_id,
-        specialist_type=request.specialist_type,
-        query_text=request.custom_query,
-        custom_prompt=request.custom_prompt,
-    )
+    if result is None:
+        result = await summary_service.generate_patient_summary(
+            patient_id=patient_id,
+            specialist_type=request.specialist_type,
+            query_text=request.custom_query,
+            custom_prompt=request.custom_prompt,
+        )
     
     # Convert sources to response model
-    from .models import Source
-    sources = [
-        Source(
-            filename=s["filename"],
-            file_id=s["file_id"],
-            s3_url=s.get("s3_url"),
-            chunk_index=s["chunk_index"],
-        )
-        for s in result["sources"]
-    ]
+    sources = _to_sources(result["sources"])
     
     return SummaryResponse(
         summary=result["summary"],
@@ -364,10 +626,82 @@ async def generate_patient_summary(
         sources=sources,
         specialist_type=result["specialist_type"],
         num_sources=result.get("num_sources", len(sources)),
+        num_tokens_in=result.get("num_tokens_in"),
         note=result.get("note"),
     )
 
 
+@app.post("/users/{username}/summary/stream", tags=["summary"])
+async def stream_patient_summary(
+    username: str,
+    request: SummaryRequest,
+) -> StreamingResponse:
+    """
+    Generate a patient health summary and stream its text as it is written.
+    
+    Takes the same body as POST /users/{username}/summary but returns the
+    summary as text/plain, starting with the first generated tokens. Sections
+    and sources are available from the non-streaming endpoint, which reuses
+    the cached result once the stream has finished. If generation fails
+    part-way, the text ends with summary_service.STREAM_ERROR_MARKER and
+    is not cached.
+    """
+    patient_id = await get_user_id_from_username(username)
+    
+    return StreamingResponse(
+        summary_service.generate_patient_summary_stream(
+            patient_id=patient_id,
+            specialist_type=request.specialist_type,
+            query_text=request.custom_query,
+            custom_prompt=request.custom_prompt,
+        ),
+        media_type="text/plain; charset=utf-8",
+    )
+
+
+@app.post(
+    "/summaries/batches",
+    response_model=SummaryBatchResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["summary"],
+)
+async def schedule_summary_batch(request: SummaryBatchRequest) -> SummaryBatchResponse:
+    """
+    Pre-generate standard summaries for several patients (e.g. tomorrow's
+    visits) through the OpenAI Batch API. Results are picked up within 24h
+    and then served by POST /users/{username}/summary.
+    """
+    if request.specialist_type.lower() not in SPECIALISTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid specialist_type: {request.specialist_type}. Available: {', '.join(summary_service.get_available_specialists())}",
+        )
+    
+    batch_id = await summary_batch_service.schedule_summaries(
+        request.patient_ids, request.specialist_type
+    )
+    if batch_id is None:
+        return SummaryBatchResponse(status="skipped", message="No patients with records to summarize, or OpenAI unavailable")
+    return SummaryBatchResponse(batch_id=batch_id, status="submitted", message="Batch submitted")
+
+
+@app.post(
+    "/summaries/batches/{batch_id}/collect",
+    response_model=SummaryBatchResponse,
+    tags=["summary"],
+)
+async def collect_summary_batch(batch_id: str) -> SummaryBatchResponse:
+    """Check a summary batch now and store its results if it has finished."""
+    try:
+        batch_status = await summary_batch_service.collect_batch(batch_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Could not check batch {batch_id}: {e}",
+        ) from e
+    return SummaryBatchResponse(batch_id=batch_id, status=batch_status, message=f"Batch is {batch_status}")
+
+
 @app.get("/specialists", tags=["summary"])
 async def get_available_specialists() -> dict:
     """Get list of available specialist types for summary generation."""
@@ -391,14 +725,26 @@ async def get_summary_pdf(
     Get the latest summary PDF for a user and specialist type.
     Returns the S3 download link when processing is complete.
     """
-    # Get user_id from username
-    patient_id = get_user_id_from_username(username)
-    
-    # Get latest summary PDF
-    summary_pdf = orchestration_service.get_latest_summary_pdf(
-        patient_id=patient_id,
-        specialist_type=specialist_type.lower(),
-    )
+    normalized_username = auth_service._normalize_username(username)
+    with _USER_ID_LOCK:
+        patient_id = _USER_ID_CACHE.get(normalized_username)
+
+    if patient_id is not None:
+        summary_pdf = await orchestration_service.get_latest_summary_pdf(
+            patient_id=patient_id,
+            specialist_type=specialist_type.lower(),
+        )
+    else:
+        # Resolve the user and fetch the latest summary PDF in one query
+        patient_id, summary_pdf = await orchestration_service.get_latest_summary_pdf_by_username(
+            normalized_username, specialist_type.lower()
+        )
+        if patient_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"User with username '{username}' not found",
+            )
+        _remember_user_id(normalized_username, patient_id)
     
     if not summary_pdf:
         raise HTTPException(
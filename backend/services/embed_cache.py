@@ -0,0 +1,197 @@
+"""
+Embedding cache.
+Memoizes OpenAI embeddings by a SHA-256 of the normalized text, so the same
+text is never embedded twice. Kept in memory by default; with
+EMBED_CACHE_PATH set, entries live in a SQLite file and survive restarts.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Seconds an embedding is reused; a model update is the only thing that
+# changes it, and the model name is part of the key anyway
+EMBED_CACHE_TTL = 30 * 86400
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH")
+# Bound on the in-memory cache used when EMBED_CACHE_PATH is unset
+EMBED_CACHE_MAX_ENTRIES = 4096
+
+# The embeddings endpoint accepts at most this many inputs per request
+MAX_BATCH_INPUTS = 2048
+
+_memory_cache: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+# The SQLite cache is only touched from worker threads, one at a time
+_cache_db: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+# Keys per SQLite lookup, under the bound-parameter limit of older SQLite builds
+_DB_LOOKUP_BATCH = 500
+# key -> future of an embedding request already in flight, so concurrent
+# callers asking for the same text share one API call
+_in_flight: Dict[str, asyncio.Future] = {}
+
+
+def _cache_key(text: str) -> str:
+    normalized = text.strip().lower()
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{normalized}".encode()).hexdigest()
+
+
+def _get_db() -> sqlite3.Connection:
+    """Open the SQLite cache on first use. Callers hold _db_lock."""
+    global _cache_db
+    if _cache_db is None:
+        _cache_db = sqlite3.connect(EMBED_CACHE_PATH, check_same_thread=False)
+        _cache_db.execute("PRAGMA journal_mode=WAL")
+        _cache_db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL,
+                vector BLOB NOT NULL
+            )
+            """
+        )
+    return _cache_db
+
+
+def _db_get_many(keys: List[str]) -> Dict[str, List[float]]:
+    now = time.time()
+    found: Dict[str, List[float]] = {}
+    with _db_lock:
+        db = _get_db()
+        for start in range(0, len(keys), _DB_LOOKUP_BATCH):
+            batch = keys[start:start + _DB_LOOKUP_BATCH]
+            rows = db.execute(
+                f"SELECT key, vector FROM embeddings WHERE expires_at > ? AND key IN ({', '.join('?' * len(batch))})",
+                (now, *batch),
+            )
+            for key, vector in rows:
+                found[key] = array('f', vector).tolist()
+    return found
+
+
+def _db_set_many(items: List[Tuple[str, List[float]]]) -> None:
+    expires_at = time.time() + EMBED_CACHE_TTL
+    with _db_lock:
+        db = _get_db()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, expires_at, vector) VALUES (?, ?, ?)",
+                [(key, expires_at, array('f', vector).tobytes()) for key, vector in items],
+            )
+
+
+def _memory_get(key: str) -> Optional[List[float]]:
+    cached = _memory_cache.get(key)
+    if cached is None:
+        return None
+    if cached[0] <= time.time():
+        del _memory_cache[key]
+        return None
+    _memory_cache.move_to_end(key)
+    return cached[1]
+
+
+async def _cache_get_many(keys: List[str]) -> Dict[str, List[float]]:
+    """Live cached embeddings among ``keys``; SQLite reads run off the event loop."""
+    if EMBED_CACHE_PATH:
+        return await asyncio.to_thread(_db_get_many, keys)
+    return {key: vector for key in keys if (vector := _memory_get(key)) is not None}
+
+
+async def _cache_set_many(items: List[Tuple[str, List[float]]]) -> None:
+    if EMBED_CACHE_PATH:
+        await asyncio.to_thread(_db_set_many, items)
+        return
+
+    expires_at = time.time() + EMBED_CACHE_TTL
+    for key, vector in items:
+        _memory_cache[key] = (expires_at, vector)
+        _memory_cache.move_to_end(key)
+    while len(_memory_cache) > EMBED_CACHE_MAX_ENTRIES:
+        _memory_cache.popitem(last=False)
+
+
+async def embed_many(client, texts: List[str]) -> List[List[float]]:
+    """
+    Embeddings for ``texts``, in order. Cached texts cost nothing; the rest
+    are requested in as few API calls as the input limit allows.
+
+    Args:
+        client: openai.AsyncOpenAI client
+        texts: Texts to embed
+
+    Returns:
+        One embedding per text
+    """
+    keys = [_cache_key(text) for text in texts]
+    texts_by_key = dict(zip(keys, texts))
+    vectors = await _cache_get_many(list(texts_by_key))
+
+    # No awaits from here until the new requests are registered, so two
+    # callers can never both start a request for the same text
+    waiting: Dict[str, asyncio.Future] = {}
+    missing: Dict[str, str] = {}
+    for key, text in texts_by_key.items():
+        if key in vectors:
+            continue
+        if key in _in_flight:
+            waiting[key] = _in_flight[key]
+        else:
+            missing[key] = text
+
+    if missing:
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in missing}
+        _in_flight.update(futures)
+        try:
+            missing_keys = list(missing)
+            for start in range(0, len(missing_keys), MAX_BATCH_INPUTS):
+                batch_keys = missing_keys[start:start + MAX_BATCH_INPUTS]
+                response = await client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=[missing[key] for key in batch_keys],
+                )
+                fresh = [(key, item.embedding) for key, item in zip(batch_keys, response.data)]
+                for key, vector in fresh:
+                    vectors[key] = vector
+                    if not futures[key].done():
+                        futures[key].set_result(vector)
+                await _cache_set_many(fresh)
+        except BaseException as e:
+            # Waiters must never be left hanging, including when this caller
+            # is cancelled; they get an ordinary error they can fall back on
+            error = e if isinstance(e, Exception) else RuntimeError("Embedding request was cancelled")
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(error)
+                    # Mark retrieved; other waiters still see the exception
+                    future.exception()
+            raise
+        finally:
+            for key in futures:
+                _in_flight.pop(key, None)
+
+    # Shielded: a cancelled waiter must not cancel the request other
+    # callers share
+    for key, future in waiting.items():
+        vectors[key] = await asyncio.shield(future)
+
+    return [vectors[key] for key in keys]
+
+
+async def embed(client, text: str) -> List[float]:
+    """Embedding for one text, served from the cache when possible."""
+    return (await embed_many(client, [text]))[0]
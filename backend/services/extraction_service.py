@@ -4,20 +4,65 @@
 from __future__ import annotations
 
 import asyncio
+import logging
+import os
 from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
+from ..utils.db import get_async_connection, get_connection
+from ..utils.s3_client import download_file_async, get_file_url
+from .pathway_rag_service import add_document_to_index
+from .pathway_service import parse_file_with_pathway
+from . import summary_service
+
+logger = logging.getLogger(__name__)
+
 # Thread pool for async extraction operations
 extraction_executor = ThreadPoolExecutor(max_workers=3)
 
+# Maximum number of extractions (S3 download + parse + index) in flight;
+# further files wait their turn instead of piling onto the executor
+MAX_CONCURRENT_EXTRACTIONS = int(os.getenv("MAX_CONCURRENT_EXTRACTIONS", "8"))
+_extraction_semaphore = asyncio.Semaphore(MAX_CONCURRENT_EXTRACTIONS)
+# Strong references to scheduled extraction tasks so they are not garbage collected
+_extraction_tasks: set[asyncio.Task] = set()
 
-def update_extraction_status(file_id: int, status: str) -> None:
-    """Update the extraction status of a file record."""
-    from ..utils.db import get_connection
+# Seconds an extraction may run before its status is flipped to 'processing'
+PROCESSING_STATUS_DELAY = 2.0
 
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+# file_id -> event set once the file's upload/extraction reaches a final state
+# (completed or failed), so waiters wake up without polling the database
+_file_events: dict[int, asyncio.Event] = {}
+
+
+def file_finished_event(file_id: int) -> asyncio.Event:
+    """Get the event that is set when a file finishes processing in this process."""
+    event = _file_events.get(file_id)
+    if event is None:
+        event = _file_events[file_id] = asyncio.Event()
+    return event
+
+
+def notify_file_finished(file_id: int) -> None:
+    """Wake everything waiting on a file that reached a final state."""
+    event = _file_events.pop(file_id, None)
+    if event is not None:
+        event.set()
+
+
+def discard_file_events(file_ids: list[int]) -> None:
+    """Forget events nobody will wait on any more."""
+    for file_id in file_ids:
+        event = _file_events.get(file_id)
+        if event is not None and not event.is_set():
+            del _file_events[file_id]
+
+
+async def update_extraction_status(file_id: int, status: str) -> None:
+    """Update the extraction status of a file record."""
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 UPDATE files 
                 SET extraction_status = %s, updated_at = NOW()
@@ -27,28 +72,46 @@ def update_extraction_status(file_id: int, status: str) -> None:
             )
 
 
-def save_extracted_text(file_id: int, extracted_text: str, metadata: Optional[dict] = None) -> None:
+def mark_extraction_processing(file_id: int) -> None:
     """
-    Save extracted text to database.
-    TODO: Create extracted_texts table or add text column to files table.
+    Flag a file as 'processing' if it is still pending.
+    The guard keeps a late write from overwriting a finished extraction.
     """
-    from ..utils.db import get_connection
-
-    # For now, just update status - will implement proper storage later
     with get_connection() as conn:
         with conn.cursor() as cur:
-            # TODO: Store extracted_text in database
-            # This is a placeholder - actual implementation will depend on schema
             cur.execute(
+                """
+                UPDATE files
+                SET extraction_status = 'processing', updated_at = NOW()
+                WHERE id = %s AND extraction_status = 'pending'
+                """,
+                (file_id,),
+            )
+
+
+async def save_extracted_text(file_id: int, extracted_text: str, metadata: Optional[dict] = None) -> None:
+    """Store the extracted text and mark extraction completed in one UPDATE."""
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 UPDATE files 
-                SET extraction_status = 'completed', updated_at = NOW()
+                SET extraction_status = 'completed', extracted_text = %s, updated_at = NOW()
                 WHERE id = %s
                 """,
-                (file_id,),
+                # Postgres TEXT cannot hold NUL characters
+                (extracted_text.replace("\x00", ""), file_id),
             )
 
 
+async def _mark_processing_after_delay(file_id: int) -> None:
+    """Write the 'processing' status only for extractions that run long."""
+    await asyncio.sleep(PROCESSING_STATUS_DELAY)
+    await asyncio.get_running_loop().run_in_executor(
+        extraction_executor, mark_extraction_processing, file_id
+    )
+
+
 async def extract_text_from_file(file_id: int, s3_key: str, file_type: str, patient_id: int, filename: str) -> None:
     """
     Extract text from a file asynchronously using Pathway parsers.
@@ -60,23 +123,15 @@ async def extract_text_from_file(file_id: int, s3_key: str, file_type: str, pati
         patient_id: Patient/user ID
         filename: Original filename
     """
-    # Update status to processing
-    update_extraction_status(file_id, "processing")
+    # Only report 'processing' if the extraction is still running after a delay;
+    # fast extractions go straight from 'pending' to 'completed'
+    processing_status = asyncio.create_task(_mark_processing_after_delay(file_id))
 
     try:
         # Download file from S3
-        from ..utils.s3_client import download_file
-
-        loop = asyncio.get_event_loop()
-        file_content = await loop.run_in_executor(
-            extraction_executor,
-            download_file,
-            s3_key,
-        )
+        file_content = await download_file_async(s3_key)
 
         # Use Pathway to parse the file
-        from .pathway_service import parse_file_with_pathway
-        
         parsed_result = await parse_file_with_pathway(
             file_content=file_content,
             file_type=file_type,
@@ -90,36 +145,69 @@ async def extract_text_from_file(file_id: int, s3_key: str, file_type: str, pati
         chunks = parsed_result.get('chunks', [])
         metadata = parsed_result.get('metadata', {})
         
-        save_extracted_text(file_id, extracted_text, metadata)
+        await save_extracted_text(file_id, extracted_text, metadata)
         
         # Index document in Pathway for RAG retrieval
         try:
-            from .pathway_rag_service import add_document_to_index
-            from ..utils.s3_client import get_file_url
-            
             # Get S3 URL
             s3_url = get_file_url(s3_key) if s3_key else None
             
             # Add to Pathway index
-            add_document_to_index(
+            await add_document_to_index(
                 text_chunks=chunks,
                 patient_id=patient_id,
                 file_id=file_id,
                 filename=filename,
                 s3_url=s3_url,
             )
-            print(f"✅ Indexed {len(chunks)} chunks in Pathway for file {file_id}")
+            summary_service.invalidate_patient_cache(patient_id)
+            logger.info("Indexed %d chunks in Pathway for file %s", len(chunks), file_id)
         except Exception as e:
             # Don't fail extraction if indexing fails
-            print(f"⚠️  Warning: Failed to index in Pathway: {e}")
+            logger.warning("Failed to index file %s in Pathway: %s", file_id, e)
 
-        print(f"✅ Successfully extracted text from file {file_id} using Pathway")
+        logger.info("Extracted text from file %s using Pathway", file_id)
 
     except Exception as e:
         # Mark extraction as failed
-        update_extraction_status(file_id, "failed")
-        print(f"❌ Failed to extract text from file {file_id}: {e}")
+        await update_extraction_status(file_id, "failed")
+        logger.error("Failed to extract text from file %s: %s", file_id, e)
         raise
+    finally:
+        processing_status.cancel()
+        # Signal after indexing so summaries see the new chunks
+        notify_file_finished(file_id)
+
+
+async def _bounded_extraction(**kwargs) -> None:
+    """Run one extraction under the process-wide concurrency limit."""
+    async with _extraction_semaphore:
+        try:
+            await extract_text_from_file(**kwargs)
+        except Exception:
+            # Already logged and recorded as failed by extract_text_from_file
+            pass
+
+
+def schedule_extraction(
+    file_id: int, s3_key: str, file_type: str, patient_id: int, filename: str
+) -> asyncio.Task:
+    """
+    Start text extraction on the running event loop without waiting for it.
+    At most MAX_CONCURRENT_EXTRACTIONS run at once; the rest queue.
+    """
+    task = asyncio.create_task(
+        _bounded_extraction(
+            file_id=file_id,
+            s3_key=s3_key,
+            file_type=file_type,
+            patient_id=patient_id,
+            filename=filename,
+        )
+    )
+    _extraction_tasks.add(task)
+    task.add_done_callback(_extraction_tasks.discard)
+    return task
 
 
 # Removed _perform_extraction - now using Pathway parsers directly
@@ -3,20 +3,50 @@
 
 from __future__ import annotations
 
+import asyncio
+import logging
 import os
-import uuid
 from concurrent.futures import ThreadPoolExecutor
-from typing import Optional
+from datetime import datetime
+from typing import BinaryIO, Optional
 
-from ..utils.db import get_connection
-from ..utils.s3_client import S3_BUCKET, upload_file
+from ..utils.db import get_async_connection, get_connection
+from ..utils.s3_client import S3_BUCKET, file_exists_async, get_file_url, upload_fileobj
+from . import extraction_service
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of S3 uploads in flight per process
+MAX_CONCURRENT_UPLOADS = 16
 
 # Thread pool for async S3 uploads (limit concurrent uploads)
-executor = ThreadPoolExecutor(max_workers=5)
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS)
+
+_upload_semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+# Strong references to scheduled upload tasks so they are not garbage collected
+_upload_tasks: set[asyncio.Task] = set()
+
+
+_FILE_VALUES_ROW = "(%s::text, %s::text, %s::bigint, %s::char(64))"
+
+
+def _file_values_sql(
+    file_specs: list[tuple[str, str, int, Optional[str]]]
+) -> tuple[str, list]:
+    """Build a multi-row VALUES placeholder list and its flattened params."""
+    values_sql = ", ".join([_FILE_VALUES_ROW] * len(file_specs))
+    params: list = []
+    for spec in file_specs:
+        params.extend(spec)
+    return values_sql, params
 
 
-def create_file_record(
-    patient_id: int, filename: str, file_type: str, file_size: int
+async def create_file_record(
+    patient_id: int,
+    filename: str,
+    file_type: str,
+    file_size: int,
+    sha256: Optional[str] = None,
 ) -> dict:
     """
     Create a file record in the database immediately.
@@ -27,28 +57,83 @@ def create_file_record(
         filename: Original filename
         file_type: File type (jpeg, png, pdf)
         file_size: File size in bytes
+        sha256: Hex SHA-256 of the file content, if known
 
     Returns:
         Dictionary with file record data
     """
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO files (patient_id, filename, file_type, file_size, upload_status)
-                VALUES (%s, %s, %s, %s, 'pending')
-                RETURNING id, filename, file_type, file_size, upload_status, created_at
+    records = await create_file_records_bulk(
+        patient_id, [(filename, file_type, file_size, sha256)]
+    )
+    return records[0]
+
+
+async def create_file_records_bulk(
+    patient_id: int, file_specs: list[tuple[str, str, int, Optional[str]]]
+) -> list[dict]:
+    """
+    Create file records for a known patient with a single multi-row INSERT.
+
+    Args:
+        patient_id: ID of the patient/user
+        file_specs: List of (filename, file_type, file_size, sha256) tuples
+
+    Returns:
+        List of created file records in spec order
+    """
+    values_sql, params = _file_values_sql(file_specs)
+
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"""
+                INSERT INTO files (patient_id, filename, file_type, file_size, sha256, upload_status)
+                SELECT %s::integer, v.filename, v.file_type, v.file_size, v.sha256, 'pending'
+                FROM (VALUES {values_sql}) AS v(filename, file_type, file_size, sha256)
+                RETURNING id, patient_id, filename, file_type, file_size, upload_status, created_at
                 """,
-                (patient_id, filename, file_type, file_size),
+                [patient_id, *params],
             )
-            return cur.fetchone()
+            return await cur.fetchall()
 
 
-def update_file_upload_status(file_id: int, status: str) -> None:
+async def create_file_records(
+    username: str, file_specs: list[tuple[str, str, int, Optional[str]]]
+) -> list[dict]:
+    """
+    Resolve a username and create one file record per spec in a single statement.
+    The user lookup and all inserts share one round trip.
+
+    Args:
+        username: Normalized username of the patient/user
+        file_specs: List of (filename, file_type, file_size, sha256) tuples
+
+    Returns:
+        List of created file records (including patient_id) in spec order,
+        or an empty list if the user does not exist
+    """
+    values_sql, params = _file_values_sql(file_specs)
+
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"""
+                WITH u AS (SELECT id FROM users WHERE username = %s)
+                INSERT INTO files (patient_id, filename, file_type, file_size, sha256, upload_status)
+                SELECT u.id, v.filename, v.file_type, v.file_size, v.sha256, 'pending'
+                FROM u, (VALUES {values_sql}) AS v(filename, file_type, file_size, sha256)
+                RETURNING id, patient_id, filename, file_type, file_size, upload_status, created_at
+                """,
+                [username, *params],
+            )
+            return await cur.fetchall()
+
+
+async def update_file_upload_status(file_id: int, status: str) -> None:
     """Update the upload status of a file record."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 UPDATE files 
                 SET upload_status = %s, updated_at = NOW()
@@ -58,11 +143,11 @@ def update_file_upload_status(file_id: int, status: str) -> None:
             )
 
 
-def update_file_s3_info(file_id: int, s3_key: str, s3_url: str) -> None:
+async def update_file_s3_info(file_id: int, s3_key: str, s3_url: str) -> None:
     """Update file record with S3 information after successful upload."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 UPDATE files 
                 SET s3_bucket = %s, s3_key = %s, s3_url = %s, 
@@ -73,111 +158,210 @@ def update_file_s3_info(file_id: int, s3_key: str, s3_url: str) -> None:
             )
 
 
+async def assign_s3_keys(patient_id: int, records: list[dict]) -> list[str]:
+    """
+    Generate S3 keys for files the client will upload directly and store
+    them in one UPDATE. The files stay 'uploading' until the client
+    reports completion.
+
+    Returns:
+        S3 keys in the same order as records
+    """
+    file_ids = [r["id"] for r in records]
+    s3_keys = [_generate_s3_key(patient_id, r["id"], r["filename"]) for r in records]
+
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE files AS f
+                SET s3_bucket = %s, s3_key = k.s3_key,
+                    upload_status = 'uploading', updated_at = NOW()
+                FROM unnest(%s::integer[], %s::text[]) AS k(id, s3_key)
+                WHERE f.id = k.id
+                """,
+                (S3_BUCKET, file_ids, s3_keys),
+            )
+    return s3_keys
+
+
+async def _mark_direct_upload_completed(file_id: int, s3_url: str) -> bool:
+    """Mark a directly uploaded file completed; False if it was not awaiting upload."""
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE files
+                SET s3_url = %s, upload_status = 'completed', updated_at = NOW()
+                WHERE id = %s AND upload_status = 'uploading'
+                """,
+                (s3_url, file_id),
+            )
+            return cur.rowcount == 1
+
+
+async def complete_direct_upload(file_record: dict) -> Optional[str]:
+    """
+    Confirm a presigned PUT reached S3, mark the file uploaded and start
+    text extraction.
+
+    Args:
+        file_record: Row from get_file_by_id for a file in 'uploading' state
+
+    Returns:
+        S3 URL of the file, or None if the object is not in S3 (yet)
+    """
+    s3_key = file_record["s3_key"]
+
+    if not await file_exists_async(s3_key):
+        return None
+
+    s3_url = get_file_url(s3_key)
+    if await _mark_direct_upload_completed(file_record["id"], s3_url):
+        # Only the call that flipped the status starts extraction
+        extraction_service.schedule_extraction(
+            file_id=file_record["id"],
+            s3_key=s3_key,
+            file_type=file_record["file_type"],
+            patient_id=file_record["patient_id"],
+            filename=file_record["filename"],
+        )
+    return s3_url
+
+
 def _generate_s3_key(patient_id: int, file_id: int, filename: str) -> str:
     """
     Generate a unique S3 key for storing the file.
-    Format: patients/{patient_id}/{file_id}_{uuid}.{ext}
+    Format: patients/{patient_id}/{file_id}_{random hex}.{ext}
     """
-    file_ext = filename.split(".")[-1].lower()
-    unique_id = str(uuid.uuid4())[:8]  # Short UUID for readability
+    file_ext = filename.rpartition(".")[2].lower()
+    unique_id = os.urandom(4).hex()  # Short random id for readability
     return f"patients/{patient_id}/{file_id}_{unique_id}.{file_ext}"
 
 
+_FILE_TYPE_MAPPING = {
+    "image/jpeg": "jpeg",
+    "image/jpg": "jpeg",
+    "image/png": "png",
+    "application/pdf": "pdf",
+}
+
+
 def _normalize_file_type(content_type: str) -> str:
     """Convert MIME type to simple file type."""
-    type_mapping = {
-        "image/jpeg": "jpeg",
-        "image/jpg": "jpeg",
-        "image/png": "png",
-        "application/pdf": "pdf",
-    }
-    return type_mapping.get(content_type.lower(), "unknown")
+    return _FILE_TYPE_MAPPING.get(content_type.lower(), "unknown")
 
 
 async def upload_file_to_s3_async(
-    file_content: bytes,
+    fileobj: BinaryIO,
     filename: str,
     content_type: str,
+    file_type: str,
     file_id: int,
     patient_id: int,
 ) -> None:
     """
-    Asynchronously upload a file to S3 using thread pool executor.
+    Asynchronously stream a file to S3 using thread pool executor.
     Updates database with S3 info on success, or marks as failed on error.
+    The file object is closed once the upload finishes.
 
     Args:
-        file_content: Binary content of the file
+        fileobj: Spooled file holding the upload, positioned at the start
         filename: Original filename
         content_type: MIME type of the file
+        file_type: Normalized file type (jpeg, png, pdf)
         file_id: Database ID of the file record
         patient_id: ID of the patient/user
     """
-    import asyncio
-
-    # Update status to uploading
-    update_file_upload_status(file_id, "uploading")
-
+    # No 'uploading' write: the row stays 'pending' until the single
+    # completed/failed UPDATE below. In-flight uploads are visible through
+    # in_flight_uploads() instead.
     try:
         # Generate S3 key
         s3_key = _generate_s3_key(patient_id, file_id, filename)
 
         # Upload to S3 in thread pool (non-blocking)
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         s3_url = await loop.run_in_executor(
             executor,
-            upload_file,
-            file_content,
+            upload_fileobj,
+            fileobj,
             s3_key,
             content_type,
             {"patient_id": str(patient_id), "file_id": str(file_id)},
         )
 
         # Update database with S3 info
-        update_file_s3_info(file_id, s3_key, s3_url)
+        await update_file_s3_info(file_id, s3_key, s3_url)
 
         # Trigger text extraction asynchronously (runs in parallel, doesn't block)
         # Extraction happens independently after upload completes
-        from . import extraction_service
-
-        # Schedule extraction task (fire and forget - runs independently)
-        # Get the current event loop and create task
-        file_type = _normalize_file_type(content_type)
-        try:
-            loop = asyncio.get_event_loop()
-            loop.create_task(
-                extraction_service.extract_text_from_file(
-                    file_id=file_id,
-                    s3_key=s3_key,
-                    file_type=file_type,
-                    patient_id=patient_id,
-                    filename=filename,
-                )
-            )
-        except RuntimeError:
-            # If no event loop is running, create a new one
-            asyncio.ensure_future(
-                extraction_service.extract_text_from_file(
-                    file_id=file_id,
-                    s3_key=s3_key,
-                    file_type=file_type,
-                    patient_id=patient_id,
-                    filename=filename,
-                )
-            )
+        extraction_service.schedule_extraction(
+            file_id=file_id,
+            s3_key=s3_key,
+            file_type=file_type,
+            patient_id=patient_id,
+            filename=filename,
+        )
 
     except Exception as e:
         # Mark as failed in database
-        update_file_upload_status(file_id, "failed")
-        # Log error (in production, use proper logging)
-        print(f"Failed to upload file {file_id} to S3: {e}")
+        await update_file_upload_status(file_id, "failed")
+        logger.error("Failed to upload file %s to S3: %s", file_id, e)
+        extraction_service.notify_file_finished(file_id)
         raise
 
+    finally:
+        fileobj.close()
+
 
-def get_file_by_id(file_id: int) -> Optional[dict]:
+async def _bounded_upload(**kwargs) -> None:
+    """Run one S3 upload under the process-wide concurrency limit."""
+    async with _upload_semaphore:
+        try:
+            await upload_file_to_s3_async(**kwargs)
+        except Exception:
+            # Already logged and recorded as failed by upload_file_to_s3_async
+            pass
+
+
+def schedule_upload_to_s3(
+    fileobj: BinaryIO,
+    filename: str,
+    content_type: str,
+    file_type: str,
+    file_id: int,
+    patient_id: int,
+) -> asyncio.Task:
+    """
+    Start an S3 upload on the running event loop without waiting for it.
+    At most MAX_CONCURRENT_UPLOADS uploads run at once; the rest queue.
+    """
+    task = asyncio.create_task(
+        _bounded_upload(
+            fileobj=fileobj,
+            filename=filename,
+            content_type=content_type,
+            file_type=file_type,
+            file_id=file_id,
+            patient_id=patient_id,
+        )
+    )
+    _upload_tasks.add(task)
+    task.add_done_callback(_upload_tasks.discard)
+    return task
+
+
+def in_flight_uploads() -> int:
+    """Number of S3 uploads scheduled or running in this process."""
+    return len(_upload_tasks)
+
+
+async def get_file_by_id(file_id: int) -> Optional[dict]:
     """Get file record by ID."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 SELECT id, patient_id, filename, file_type, file_size,
                        s3_bucket, s3_key, s3_url, upload_status, extraction_status,
@@ -187,11 +371,25 @@ def get_file_by_id(file_id: int) -> Optional[dict]:
                 """,
                 (file_id,),
             )
-            return cur.fetchone()
+            return await cur.fetchone()
 
 
-def get_patient_files(patient_id: int) -> list[dict]:
-    """Get all files for a patient."""
+def get_patient_files(
+    patient_id: int,
+    limit: int = 100,
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+) -> list[dict]:
+    """
+    Get a patient's files, newest first.
+
+    Args:
+        patient_id: Patient/user ID
+        limit: Maximum number of files to return
+        before: Only return files created before this time (for paging)
+        before_id: With `before`, id of the last file already seen; files
+            uploaded in one batch share a created_at
+    """
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
@@ -200,9 +398,59 @@ def get_patient_files(patient_id: int) -> list[dict]:
                        upload_status, extraction_status, created_at
                 FROM files
                 WHERE patient_id = %s
-                ORDER BY created_at DESC
+                  AND (created_at, id) < (COALESCE(%s::timestamptz, 'infinity'), COALESCE(%s::integer, 0))
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
                 """,
-                (patient_id,),
+                (patient_id, before, before_id, limit),
             )
             return cur.fetchall()
 
+
+
+async def get_files_by_username(
+    username: str,
+    limit: int = 100,
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+) -> tuple[Optional[int], list[dict]]:
+    """
+    Resolve a username and fetch its files, newest first, in a single round trip.
+
+    Args:
+        username: Normalized username
+        limit: Maximum number of files to return
+        before: Only return files created before this time (for paging)
+        before_id: With `before`, id of the last file already seen; files
+            uploaded in one batch share a created_at
+
+    Returns:
+        (patient_id, files) - patient_id is None if the user does not exist
+    """
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT u.id AS patient_id, f.id, f.filename, f.file_type, f.file_size,
+                       f.s3_url, f.upload_status, f.extraction_status, f.created_at
+                FROM users u
+                LEFT JOIN LATERAL (
+                    SELECT id, filename, file_type, file_size, s3_url,
+                           upload_status, extraction_status, created_at
+                    FROM files
+                    WHERE patient_id = u.id
+                      AND (created_at, id) < (COALESCE(%s::timestamptz, 'infinity'), COALESCE(%s::integer, 0))
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                ) f ON TRUE
+                WHERE u.username = %s
+                ORDER BY f.created_at DESC, f.id DESC
+                """,
+                (before, before_id, limit, username),
+                prepare=True,
+            )
+            rows = await cur.fetchall()
+
+    if not rows:
+        return None, []
+    return rows[0]["patient_id"], [r for r in rows if r["id"] is not None]
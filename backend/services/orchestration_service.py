@@ -7,16 +7,39 @@ Coordinates file upload, extraction, RAG indexing, summary generation, and PDF c
 from __future__ import annotations
 
 import asyncio
-import time
-import uuid
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
 
-from ..utils.db import get_connection
-from ..utils.s3_client import S3_BUCKET, upload_file
-from . import summary_service, pdf_service
+from ..utils.db import get_async_connection
+from ..utils.s3_client import S3_BUCKET, upload_fileobj_async
+from . import extraction_service, summary_service, pdf_service
+from .file_service import _file_values_sql
 
+logger = logging.getLogger(__name__)
 
-def create_summary_pdf_record(
+# Upper bound on how long wait_for_files_processing sleeps between status
+# checks when no in-process completion event arrives
+FILE_STATUS_POLL_INTERVAL = 30
+
+# Summary PDFs are rendered into spooled files that stay in memory up to
+# this size and roll over to disk beyond it
+_PDF_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# Shared pool for the blocking PDF render and S3 upload of every pipeline run;
+# shut down with the app
+_summary_pdf_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="summary-pdf")
+
+
+def shutdown_executor() -> None:
+    """Wait for in-flight PDF renders/uploads and stop the worker threads."""
+    _summary_pdf_executor.shutdown(wait=True)
+
+
+async def create_summary_pdf_record(
     patient_id: int,
     specialist_type: str,
     file_ids: List[int],
@@ -25,26 +48,93 @@ def create_summary_pdf_record(
     Create a summary PDF record in the database.
     
     Returns:
-        Dictionary with summary PDF record data
+        Dictionary with summary PDF record data, including the patient's
+        name for the PDF header
     """
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 INSERT INTO summary_pdfs (patient_id, specialist_type, file_ids, status)
                 VALUES (%s, %s, %s, 'processing')
-                RETURNING id, patient_id, specialist_type, status, created_at
+                RETURNING id, patient_id, specialist_type, status, created_at,
+                          (SELECT full_name FROM users WHERE id = %s) AS patient_name
+                """,
+                (patient_id, specialist_type, file_ids, patient_id),
+            )
+            return await cur.fetchone()
+
+
+async def create_upload_batch(
+    username: str,
+    file_specs: List[tuple[str, str, int, Optional[str]]],
+    specialist_type: str,
+) -> tuple[List[dict], Optional[dict]]:
+    """
+    Create the file records for an upload and the summary PDF record that
+    covers them in one statement, so both commit together in one round trip.
+
+    Args:
+        username: Normalized username of the patient/user
+        file_specs: List of (filename, file_type, file_size, sha256) tuples
+        specialist_type: Type of specialist for the summary
+
+    Returns:
+        (file records in spec order, summary PDF record including the
+        patient's name), or ([], None) if the user does not exist
+    """
+    values_sql, params = _file_values_sql(file_specs)
+
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"""
+                WITH u AS (SELECT id, full_name FROM users WHERE username = %s),
+                f AS (
+                    INSERT INTO files (patient_id, filename, file_type, file_size, sha256, upload_status)
+                    SELECT u.id, v.filename, v.file_type, v.file_size, v.sha256, 'pending'
+                    FROM u, (VALUES {values_sql}) AS v(filename, file_type, file_size, sha256)
+                    RETURNING id, patient_id, filename, file_type, file_size, upload_status, created_at
+                ),
+                s AS (
+                    INSERT INTO summary_pdfs (patient_id, specialist_type, file_ids, status)
+                    SELECT patient_id, %s, array_agg(id ORDER BY id), 'processing'
+                    FROM f
+                    GROUP BY patient_id
+                    RETURNING id, status, created_at
+                )
+                SELECT f.*, s.id AS summary_id, s.status AS summary_status,
+                       s.created_at AS summary_created_at, u.full_name AS summary_patient_name
+                FROM f CROSS JOIN s CROSS JOIN u
+                ORDER BY f.id
                 """,
-                (patient_id, specialist_type, file_ids),
+                [username, *params, specialist_type],
             )
-            return cur.fetchone()
+            rows = await cur.fetchall()
+
+    if not rows:
+        return [], None
 
+    first = rows[0]
+    summary_record = {
+        "id": first["summary_id"],
+        "patient_id": first["patient_id"],
+        "specialist_type": specialist_type,
+        "status": first["summary_status"],
+        "created_at": first["summary_created_at"],
+        "patient_name": first["summary_patient_name"],
+    }
+    file_records = [
+        {k: v for k, v in row.items() if not k.startswith("summary_")} for row in rows
+    ]
+    return file_records, summary_record
 
-def update_summary_pdf_status(summary_id: int, status: str) -> None:
+
+async def update_summary_pdf_status(summary_id: int, status: str) -> None:
     """Update the status of a summary PDF record."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 UPDATE summary_pdfs 
                 SET status = %s, updated_at = NOW()
@@ -54,26 +144,84 @@ def update_summary_pdf_status(summary_id: int, status: str) -> None:
             )
 
 
-def update_summary_pdf_s3_info(summary_id: int, s3_key: str, s3_url: str) -> None:
+async def update_summary_pdf_s3_info(
+    summary_id: int,
+    s3_key: str,
+    s3_url: str,
+    content_hash: Optional[str] = None,
+    s3_bucket: Optional[str] = None,
+) -> None:
     """Update summary PDF record with S3 information."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 UPDATE summary_pdfs 
-                SET s3_bucket = %s, s3_key = %s, s3_url = %s, 
+                SET s3_bucket = %s, s3_key = %s, s3_url = %s, content_hash = %s,
                     status = 'completed', updated_at = NOW()
                 WHERE id = %s
                 """,
-                (S3_BUCKET, s3_key, s3_url, summary_id),
+                (s3_bucket or S3_BUCKET, s3_key, s3_url, content_hash, summary_id),
             )
 
 
-def get_summary_pdf_by_id(summary_id: int) -> Optional[dict]:
+async def find_cached_summary_pdf(
+    patient_id: int,
+    specialist_type: str,
+    custom_prompt: Optional[str],
+    patient_name: Optional[str],
+) -> tuple[str, Optional[dict]]:
+    """
+    Hash the inputs a summary PDF is built from and look for a completed PDF
+    with the same hash.
+
+    A summary covers every processed file of the patient, so the hash takes
+    the set of their content hashes (files without one count by id and
+    update time) along with the specialist type, custom prompt and patient
+    name. Any new, changed or re-processed document changes the hash.
+
+    Returns:
+        (content_hash, previous summary PDF record or None)
+    """
+    prefix = json.dumps([specialist_type, custom_prompt, patient_name])
+
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                WITH h AS (
+                    SELECT encode(sha256(convert_to(
+                               %s || COALESCE(string_agg(k, ',' ORDER BY k), ''), 'UTF8'
+                           )), 'hex') AS content_hash
+                    FROM (
+                        SELECT DISTINCT COALESCE(sha256, 'file:' || id || '@' || updated_at) AS k
+                        FROM files
+                        WHERE patient_id = %s AND extraction_status = 'completed'
+                    ) f
+                )
+                SELECT h.content_hash, s.id, s.s3_bucket, s.s3_key, s.s3_url
+                FROM h
+                LEFT JOIN LATERAL (
+                    SELECT id, s3_bucket, s3_key, s3_url
+                    FROM summary_pdfs
+                    WHERE patient_id = %s AND content_hash = h.content_hash AND status = 'completed'
+                    ORDER BY id DESC
+                    LIMIT 1
+                ) s ON TRUE
+                """,
+                (prefix, patient_id, patient_id),
+            )
+            row = await cur.fetchone()
+
+    content_hash = row.pop("content_hash")
+    return content_hash, (row if row["id"] is not None else None)
+
+
+async def get_summary_pdf_by_id(summary_id: int) -> Optional[dict]:
     """Get summary PDF record by ID."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 SELECT id, patient_id, specialist_type, s3_url, status, file_ids, created_at
                 FROM summary_pdfs
@@ -81,14 +229,14 @@ def get_summary_pdf_by_id(summary_id: int) -> Optional[dict]:
                 """,
                 (summary_id,),
             )
-            return cur.fetchone()
+            return await cur.fetchone()
 
 
-def get_latest_summary_pdf(patient_id: int, specialist_type: str) -> Optional[dict]:
+async def get_latest_summary_pdf(patient_id: int, specialist_type: str) -> Optional[dict]:
     """Get the latest summary PDF for a patient and specialist type."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 SELECT id, patient_id, specialist_type, s3_url, status, file_ids, created_at
                 FROM summary_pdfs
@@ -98,62 +246,116 @@ def get_latest_summary_pdf(patient_id: int, specialist_type: str) -> Optional[di
                 """,
                 (patient_id, specialist_type),
             )
-            return cur.fetchone()
+            return await cur.fetchone()
+
+
+async def get_latest_summary_pdf_by_username(username: str, specialist_type: str) -> tuple[Optional[int], Optional[dict]]:
+    """
+    Resolve a username and get its latest summary PDF in one query.
+
+    Returns:
+        (patient_id, summary_pdf) - patient_id is None if the user does not exist
+    """
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT u.id AS user_id, s.id, s.patient_id, s.specialist_type, s.s3_url,
+                       s.status, s.file_ids, s.created_at
+                FROM users u
+                LEFT JOIN LATERAL (
+                    SELECT id, patient_id, specialist_type, s3_url, status, file_ids, created_at
+                    FROM summary_pdfs
+                    WHERE patient_id = u.id AND specialist_type = %s
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ) s ON TRUE
+                WHERE u.username = %s
+                """,
+                (specialist_type, username),
+            )
+            row = await cur.fetchone()
+
+    if not row:
+        return None, None
+    user_id = row.pop("user_id")
+    return user_id, (row if row["id"] is not None else None)
+
+
+async def _get_finished_files(file_ids: List[int]) -> List[dict]:
+    """
+    Return only those of ``file_ids`` that have finished processing, each with
+    a ``failed`` flag; files still in progress are not returned.
+    """
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT id, (upload_status = 'failed' OR extraction_status = 'failed') AS failed
+                FROM files
+                WHERE id = ANY(%s)
+                  AND (upload_status = 'failed'
+                       OR extraction_status = 'failed'
+                       OR (upload_status = 'completed' AND extraction_status = 'completed'))
+                """,
+                (file_ids,),
+            )
+            return await cur.fetchall()
 
 
 async def wait_for_files_processing(file_ids: List[int], max_wait_seconds: int = 300) -> bool:
     """
     Wait for all files to complete processing (upload + extraction).
+    Wakes up when the extraction pipeline in this process signals a file is
+    done; the database is re-checked at least every FILE_STATUS_POLL_INTERVAL
+    seconds to catch work finished elsewhere.
     
     Args:
         file_ids: List of file IDs to wait for
         max_wait_seconds: Maximum time to wait (default 5 minutes)
     
     Returns:
-        True if all files completed, False if timeout
+        True if all files completed, False if any failed or on timeout
     """
-    from ..utils.db import get_connection
-    
-    start_time = time.time()
-    
-    while True:
-        # Check elapsed time
-        elapsed = time.time() - start_time
-        if elapsed > max_wait_seconds:
-            print(f"Timeout waiting for files {file_ids} to process")
-            return False
-        
-        # Check file statuses
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT id, upload_status, extraction_status
-                    FROM files
-                    WHERE id = ANY(%s)
-                    """,
-                    (file_ids,),
-                )
-                files = cur.fetchall()
-        
-        # Check if all files are completed
-        all_completed = True
-        for file in files:
-            if file["upload_status"] != "completed" or file["extraction_status"] != "completed":
-                all_completed = False
-                break
-        
-        if all_completed:
-            print(f"All files {file_ids} completed processing")
-            return True
-        
-        # Wait before checking again
-        await asyncio.sleep(5)  # Check every 5 seconds
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait_seconds
+    # Only files not yet seen as finished are re-checked on each pass
+    pending = set(file_ids)
+
+    try:
+        while True:
+            # Take the events before reading statuses so a file finishing
+            # in between still wakes us
+            events = {fid: extraction_service.file_finished_event(fid) for fid in pending}
+            finished = await _get_finished_files(list(pending))
+
+            if any(f["failed"] for f in finished):
+                logger.warning("Files %s failed processing", file_ids)
+                return False
+
+            pending.difference_update(f["id"] for f in finished)
+            if not pending:
+                logger.info("All files %s completed processing", file_ids)
+                return True
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.warning("Timeout waiting for files %s to process", file_ids)
+                return False
+
+            waiters = [asyncio.ensure_future(events[fid].wait()) for fid in pending]
+            try:
+                await asyncio.wait(waiters, timeout=min(remaining, FILE_STATUS_POLL_INTERVAL))
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+    finally:
+        extraction_service.discard_file_events(file_ids)
 
 
 def _generate_s3_key_for_summary(patient_id: int, summary_id: int, specialist_type: str) -> str:
     """Generate S3 key for summary PDF."""
-    unique_id = str(uuid.uuid4())[:8]
+    unique_id = os.urandom(4).hex()  # Short random id for readability
     return f"summaries/{patient_id}/{specialist_type}_{summary_id}_{unique_id}.pdf"
 
 
@@ -163,6 +365,7 @@ async def process_end_to_end_pipeline(
     specialist_type: str,
     summary_id: int,
     custom_prompt: Optional[str] = None,
+    patient_name: Optional[str] = None,
 ) -> dict:
     """
     End-to-end processing pipeline:
@@ -178,24 +381,46 @@ async def process_end_to_end_pipeline(
         specialist_type: Type of specialist for summary
         summary_id: Summary PDF record ID
         custom_prompt: Optional custom prompt for summary generation
+        patient_name: Patient name for the PDF header, as returned with the
+            summary PDF record
     
     Returns:
         Dictionary with summary PDF S3 URL and status
     """
     try:
         # Step 1: Wait for all files to be processed
-        print(f"Waiting for files {file_ids} to complete processing...")
+        logger.info("Waiting for files %s to complete processing", file_ids)
         files_ready = await wait_for_files_processing(file_ids, max_wait_seconds=300)
         
         if not files_ready:
-            update_summary_pdf_status(summary_id, "failed")
+            await update_summary_pdf_status(summary_id, "failed")
             return {
                 "status": "failed",
                 "error": "Files did not complete processing within timeout period",
             }
         
+        # Reuse the PDF of an earlier run over exactly the same inputs
+        content_hash, cached_pdf = await find_cached_summary_pdf(
+            patient_id, specialist_type, custom_prompt, patient_name
+        )
+        if cached_pdf:
+            await update_summary_pdf_s3_info(
+                summary_id,
+                cached_pdf["s3_key"],
+                cached_pdf["s3_url"],
+                content_hash,
+                cached_pdf["s3_bucket"],
+            )
+            logger.info("Summary PDF %s reused summary %s: %s", summary_id, cached_pdf["id"], cached_pdf["s3_url"])
+            return {
+                "status": "completed",
+                "summary_id": summary_id,
+                "s3_url": cached_pdf["s3_url"],
+                "specialist_type": specialist_type,
+            }
+        
         # Step 2: Generate summary
-        print(f"Generating summary for patient {patient_id}, specialist {specialist_type}...")
+        logger.info("Generating summary for patient %s, specialist %s", patient_id, specialist_type)
         summary_result = await summary_service.generate_patient_summary(
             patient_id=patient_id,
             specialist_type=specialist_type,
@@ -203,56 +428,47 @@ async def process_end_to_end_pipeline(
         )
         
         if not summary_result.get("summary"):
-            update_summary_pdf_status(summary_id, "failed")
+            await update_summary_pdf_status(summary_id, "failed")
             return {
                 "status": "failed",
                 "error": "Failed to generate summary - no data found",
             }
         
-        # Step 3: Get patient name for PDF header
-        from ..utils.db import get_connection
-        patient_name = None
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT full_name FROM users WHERE id = %s", (patient_id,))
-                row = cur.fetchone()
-                if row:
-                    patient_name = row["full_name"]
-        
-        # Step 4: Generate PDF
-        print(f"Generating PDF for summary {summary_id}...")
-        pdf_bytes = pdf_service.generate_summary_pdf(
-            summary_text=summary_result["summary"],
-            patient_name=patient_name,
-            specialist_type=specialist_type,
-        )
-        
-        # Step 5: Upload PDF to S3
-        print(f"Uploading PDF to S3 for summary {summary_id}...")
-        s3_key = _generate_s3_key_for_summary(patient_id, summary_id, specialist_type)
-        
-        # Upload in thread pool (S3 upload is blocking)
-        loop = asyncio.get_event_loop()
-        from concurrent.futures import ThreadPoolExecutor
-        executor = ThreadPoolExecutor(max_workers=2)
-        
-        s3_url = await loop.run_in_executor(
-            executor,
-            upload_file,
-            pdf_bytes,
-            s3_key,
-            "application/pdf",
-            {
-                "patient_id": str(patient_id),
-                "summary_id": str(summary_id),
-                "specialist_type": specialist_type,
-            },
-        )
+        # Rendering and upload are blocking, so both run in a thread pool
+        loop = asyncio.get_running_loop()
+
+        with tempfile.SpooledTemporaryFile(max_size=_PDF_SPOOL_MAX_MEMORY) as pdf_file:
+            # Step 3: Generate PDF
+            logger.info("Generating PDF for summary %s", summary_id)
+            await loop.run_in_executor(
+                _summary_pdf_executor,
+                pdf_service.write_summary_pdf,
+                pdf_file,
+                summary_result["summary"],
+                patient_name,
+                specialist_type,
+            )
+            pdf_file.seek(0)
+
+            # Step 4: Stream PDF to S3 (multipart for large files)
+            logger.info("Uploading PDF to S3 for summary %s", summary_id)
+            s3_key = _generate_s3_key_for_summary(patient_id, summary_id, specialist_type)
+
+            s3_url = await upload_fileobj_async(
+                pdf_file,
+                s3_key,
+                "application/pdf",
+                {
+                    "patient_id": str(patient_id),
+                    "summary_id": str(summary_id),
+                    "specialist_type": specialist_type,
+                },
+            )
         
-        # Step 6: Update database with S3 info
-        update_summary_pdf_s3_info(summary_id, s3_key, s3_url)
+        # Step 5: Update database with S3 info
+        await update_summary_pdf_s3_info(summary_id, s3_key, s3_url, content_hash)
         
-        print(f"✅ Summary PDF {summary_id} completed: {s3_url}")
+        logger.info("Summary PDF %s completed: %s", summary_id, s3_url)
         
         return {
             "status": "completed",
@@ -262,8 +478,8 @@ async def process_end_to_end_pipeline(
         }
     
     except Exception as e:
-        print(f"❌ Error in end-to-end pipeline for summary {summary_id}: {e}")
-        update_summary_pdf_status(summary_id, "failed")
+        logger.exception("Error in end-to-end pipeline for summary %s: %s", summary_id, e)
+        await update_summary_pdf_status(summary_id, "failed")
         return {
             "status": "failed",
             "error": str(e),
@@ -7,13 +7,65 @@ Can be extended to full Pathway dataflow later.
 
 from __future__ import annotations
 
+import asyncio
+import heapq
+import json
+import logging
+import math
 import os
-from typing import Optional, List, Dict, Any
-from collections import defaultdict
+import re
+import sqlite3
+import threading
+from array import array
+from itertools import groupby
+from typing import Optional, List, Dict, Any, Set
+from collections import Counter, defaultdict
 
-# In-memory document store (for hackathon - can be replaced with Pathway dataflow)
-_document_chunks: List[Dict[str, Any]] = []
+logger = logging.getLogger(__name__)
+
+# In-memory document store (for hackathon - can be replaced with Pathway dataflow).
+# Stored column-wise: one entry per chunk in each parallel column, file-level
+# fields once per file, and parser metadata only for chunks that have any.
+_texts: List[str] = []
+_chunk_file_ids = array('i')
+_chunk_patient_ids = array('i')
+_chunk_indexes = array('i')
+_file_meta: Dict[int, Dict[str, Any]] = {}
+_chunk_metadata: Dict[int, dict] = {}
 _rag_initialized = False
+_rag_init_lock = threading.Lock()
+
+# OpenAI key resolved once at initialization
+_OPENAI_KEY: Optional[str] = None
+
+# Inverted index over the chunk store, maintained by add_document_to_index:
+# term counts per chunk (same positions as _texts), term -> chunk positions
+# containing it, and patient -> chunk positions
+_chunk_tokens: List[Counter] = []
+_postings: Dict[str, Set[int]] = defaultdict(set)
+_patient_to_chunks: Dict[int, List[int]] = defaultdict(list)
+# Token count per chunk and over the whole index, for BM25 length normalization
+_chunk_lengths: List[int] = []
+_total_tokens = 0
+
+# BM25 parameters: term-frequency saturation and length normalization
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Optional SQLite file mirroring the chunk store. When set, indexed chunks
+# survive restarts and are reloaded on initialization instead of having to
+# re-parse every file.
+RAG_INDEX_PATH = os.getenv("RAG_INDEX_PATH")
+_index_db: Optional[sqlite3.Connection] = None
+# Persistence runs in worker threads; writes to the one connection take turns
+_index_db_lock = threading.Lock()
+
+
+def _tokenize(text: str) -> List[str]:
+    """Lowercase word tokens used for both indexing and queries."""
+    return _TOKEN_RE.findall(text.lower())
 
 
 def initialize_pathway_rag(
@@ -25,21 +77,111 @@ def initialize_pathway_rag(
     For hackathon: Simple in-memory storage.
     For production: Would set up full Pathway dataflow with embeddings and vector index.
     
+    Runs once per process; later calls return immediately.
+    
     Args:
         openai_api_key: OpenAI API key (or set OPENAI_API_KEY env var)
     """
-    global _rag_initialized
+    global _rag_initialized, _OPENAI_KEY
+    
+    if _rag_initialized:
+        return
+    
+    with _rag_init_lock:
+        if _rag_initialized:
+            return
+        
+        # Check if OpenAI key is available (needed for embeddings/LLM later)
+        _OPENAI_KEY = openai_api_key or os.getenv("OPENAI_API_KEY")
+        if not _OPENAI_KEY:
+            logger.warning("OPENAI_API_KEY not set. RAG queries will be limited.")
+        
+        if RAG_INDEX_PATH:
+            _load_persisted_index(RAG_INDEX_PATH)
+        
+        _rag_initialized = True
+    logger.info("Pathway RAG service initialized (%d chunks in memory)", len(_texts))
+
+
+def _load_persisted_index(path: str) -> None:
+    """Open the on-disk chunk store and rebuild the in-memory index from it."""
+    global _index_db
     
-    # Check if OpenAI key is available (needed for embeddings/LLM later)
-    api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print("⚠️  Warning: OPENAI_API_KEY not set. RAG queries will be limited.")
+    _index_db = sqlite3.connect(path, check_same_thread=False)
+    _index_db.execute("PRAGMA journal_mode=WAL")
+    _index_db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY,
+            patient_id INTEGER NOT NULL,
+            file_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            s3_url TEXT,
+            text TEXT NOT NULL,
+            metadata TEXT NOT NULL
+        )
+        """
+    )
     
-    _rag_initialized = True
-    print("✅ Pathway RAG service initialized (in-memory storage)")
+    rows = _index_db.execute(
+        "SELECT patient_id, file_id, filename, chunk_index, s3_url, text, metadata FROM chunks ORDER BY id"
+    )
+    # Chunks of one file were written together, in order
+    for (patient_id, file_id, filename, s3_url), file_rows in groupby(
+        rows, key=lambda row: (row[0], row[1], row[2], row[4])
+    ):
+        text_chunks = [(text, json.loads(metadata)) for *_, text, metadata in file_rows]
+        _index_file_chunks(text_chunks, patient_id, file_id, filename, s3_url)
 
 
-def add_document_to_index(
+def _index_file_chunks(
+    text_chunks: List[tuple[str, dict]],
+    patient_id: int,
+    file_id: int,
+    filename: str,
+    s3_url: Optional[str],
+) -> None:
+    """Bulk-append one file's chunks to the in-memory store, tokenizing each once."""
+    global _total_tokens
+    
+    start = len(_texts)
+    count = len(text_chunks)
+    
+    _file_meta[file_id] = {'filename': filename, 's3_url': s3_url}
+    _texts.extend(text for text, _ in text_chunks)
+    _chunk_file_ids.extend([file_id] * count)
+    _chunk_patient_ids.extend([patient_id] * count)
+    _chunk_indexes.extend(range(count))
+    _patient_to_chunks[patient_id].extend(range(start, start + count))
+    
+    for position, (text, chunk_metadata) in enumerate(text_chunks, start):
+        if chunk_metadata:
+            _chunk_metadata[position] = chunk_metadata
+        tokens = _tokenize(text)
+        token_counts = Counter(tokens)
+        _chunk_tokens.append(token_counts)
+        _chunk_lengths.append(len(tokens))
+        _total_tokens += len(tokens)
+        for token in token_counts:
+            _postings[token].add(position)
+
+
+def _chunk_record(position: int) -> Dict[str, Any]:
+    """Materialize the chunk at ``position`` as a dict for callers."""
+    file_meta = _file_meta[_chunk_file_ids[position]]
+    return {
+        'text': _texts[position],
+        'patient_id': _chunk_patient_ids[position],
+        'file_id': _chunk_file_ids[position],
+        'filename': file_meta['filename'],
+        'chunk_index': _chunk_indexes[position],
+        's3_url': file_meta['s3_url'],
+        'metadata': _chunk_metadata.get(position, {}),
+    }
+
+
+async def add_document_to_index(
     text_chunks: List[tuple[str, dict]],
     patient_id: int,
     file_id: int,
@@ -52,6 +194,9 @@ def add_document_to_index(
     For hackathon: Stores in memory.
     For production: Would add to Pathway dataflow with automatic embeddings.
     
+    The chunks are searchable as soon as they are in memory; with
+    RAG_INDEX_PATH set, the disk write then runs in a worker thread.
+    
     Args:
         text_chunks: List of (text, metadata) tuples from parser
         patient_id: Patient/user ID
@@ -59,25 +204,39 @@ def add_document_to_index(
         filename: Original filename
         s3_url: S3 URL of the file (optional)
     """
-    global _document_chunks
-    
     if not _rag_initialized:
         initialize_pathway_rag()
     
     # Store chunks with metadata for retrieval
-    for idx, (text, chunk_metadata) in enumerate(text_chunks):
-        chunk_data = {
-            'text': text,
-            'patient_id': patient_id,
-            'file_id': file_id,
-            'filename': filename,
-            'chunk_index': idx,
-            's3_url': s3_url,
-            'metadata': {**chunk_metadata},
-        }
-        _document_chunks.append(chunk_data)
+    _index_file_chunks(text_chunks, patient_id, file_id, filename, s3_url)
+    logger.info("Added %d chunks to index (total: %d chunks)", len(text_chunks), len(_texts))
     
-    print(f"✅ Added {len(text_chunks)} chunks to index (total: {len(_document_chunks)} chunks)")
+    if _index_db is not None:
+        await asyncio.to_thread(
+            _persist_file_chunks, text_chunks, patient_id, file_id, filename, s3_url
+        )
+
+
+def _persist_file_chunks(
+    text_chunks: List[tuple[str, dict]],
+    patient_id: int,
+    file_id: int,
+    filename: str,
+    s3_url: Optional[str],
+) -> None:
+    """Write one file's chunks to the on-disk store in a single transaction."""
+    rows = [
+        (patient_id, file_id, filename, idx, s3_url, text, json.dumps(chunk_metadata, default=str))
+        for idx, (text, chunk_metadata) in enumerate(text_chunks)
+    ]
+    with _index_db_lock, _index_db:
+        _index_db.executemany(
+            """
+            INSERT INTO chunks (patient_id, file_id, filename, chunk_index, s3_url, text, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
 
 
 async def query_rag(
@@ -102,12 +261,13 @@ async def query_rag(
     if not _rag_initialized:
         initialize_pathway_rag()
     
-    # Filter by patient_id if provided
-    candidate_chunks = _document_chunks
+    # Filter by patient_id if provided (O(1) via the per-patient index)
     if patient_id is not None:
-        candidate_chunks = [c for c in _document_chunks if c.get('patient_id') == patient_id]
+        has_documents = bool(_patient_to_chunks.get(patient_id))
+    else:
+        has_documents = bool(_texts)
     
-    if not candidate_chunks:
+    if not has_documents:
         return {
             'query': query,
             'answer': "No documents found for this patient.",
@@ -115,21 +275,48 @@ async def query_rag(
             'retrieved_chunks': [],
         }
     
-    # Simple text matching (for hackathon)
+    # Keyword matching over the inverted index (for hackathon)
     # In production, would use vector similarity search
-    query_lower = query.lower()
-    scored_chunks = []
+    query_tokens = set(_tokenize(query))
+    
+    # Only chunks sharing at least one term with the query are scored. With a
+    # patient, postings are intersected with that patient's chunks first
+    # (set & walks the smaller side), so common terms never pull in the
+    # rest of the index.
+    candidates: Set[int] = set()
+    if patient_id is not None:
+        patient_chunks = set(_patient_to_chunks[patient_id])
+        for token in query_tokens:
+            postings = _postings.get(token)
+            if postings:
+                candidates |= postings & patient_chunks
+    else:
+        for token in query_tokens:
+            candidates |= _postings.get(token, set())
     
-    for chunk in candidate_chunks:
-        text = chunk['text'].lower()
-        # Simple relevance score (word overlap)
-        score = sum(1 for word in query_lower.split() if word in text)
-        if score > 0:
-            scored_chunks.append((score, chunk))
+    # Relevance score: BM25 over the whole index; IDF is computed once per query
+    num_chunks = len(_texts)
+    avg_length = (_total_tokens / num_chunks) or 1.0
+    idf = {}
+    for token in query_tokens:
+        df = len(_postings.get(token, ()))
+        if df:
+            idf[token] = math.log(1 + (num_chunks - df + 0.5) / (df + 0.5))
     
-    # Sort by score and get top_k
-    scored_chunks.sort(reverse=True, key=lambda x: x[0])
-    top_chunks = [chunk for _, chunk in scored_chunks[:top_k]]
+    def score(position: int) -> float:
+        counts = _chunk_tokens[position]
+        norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * _chunk_lengths[position] / avg_length)
+        total = 0.0
+        for token, weight in idf.items():
+            tf = counts.get(token)
+            if tf:
+                total += weight * tf * (_BM25_K1 + 1) / (tf + norm)
+        return total
+    
+    # O(N log k) partial selection; ties go to the earlier-indexed chunk via
+    # the position in the key, so the candidate set never needs a full sort
+    top_positions = heapq.nlargest(top_k, candidates, key=lambda i: (score(i), -i))
+    top_chunks = [_chunk_record(i) for i in top_positions]
     
     # Combine retrieved text
     retrieved_text = "\n\n".join([chunk['text'] for chunk in top_chunks])
@@ -142,7 +329,7 @@ async def query_rag(
         {
             'filename': chunk['filename'],
             'file_id': chunk['file_id'],
-            's3_url': chunk.get('s3_url'),
+            's3_url': chunk['s3_url'],
             'chunk_index': chunk['chunk_index'],
         }
         for chunk in top_chunks
@@ -153,7 +340,7 @@ async def query_rag(
         'answer': answer,
         'sources': sources,
         'retrieved_chunks': top_chunks,
-        'num_chunks_found': len(scored_chunks),
+        'num_chunks_found': len(candidates),
     }
 
 
@@ -167,22 +354,21 @@ def get_patient_documents(patient_id: int) -> List[Dict[str, Any]]:
     Returns:
         List of document metadata
     """
-    patient_chunks = [c for c in _document_chunks if c.get('patient_id') == patient_id]
-    
-    # Group by file_id
+    # Group chunk positions by file_id
     files = defaultdict(list)
-    for chunk in patient_chunks:
-        files[chunk['file_id']].append(chunk)
+    for position in _patient_to_chunks.get(patient_id, ()):
+        files[_chunk_file_ids[position]].append(position)
     
     # Return file summaries
     file_list = []
-    for file_id, chunks in files.items():
+    for file_id, positions in files.items():
+        file_meta = _file_meta[file_id]
         file_list.append({
             'file_id': file_id,
-            'filename': chunks[0]['filename'],
-            's3_url': chunks[0].get('s3_url'),
-            'num_chunks': len(chunks),
-            'total_text_length': sum(len(c['text']) for c in chunks),
+            'filename': file_meta['filename'],
+            's3_url': file_meta['s3_url'],
+            'num_chunks': len(positions),
+            'total_text_length': sum(len(_texts[i]) for i in positions),
         })
     
     return file_list
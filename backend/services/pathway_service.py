@@ -7,7 +7,12 @@ Replaces custom OCR extraction with Pathway's built-in parsers.
 from __future__ import annotations
 
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional
 
 try:
@@ -16,8 +21,17 @@ except ImportError:
     DoclingParser = None  # type: ignore
     PaddleOCRParser = None  # type: ignore
 
-# Thread pool for async Pathway operations
-pathway_executor = ThreadPoolExecutor(max_workers=2)
+logger = logging.getLogger(__name__)
+
+# Parsing is CPU-bound and holds the GIL for long stretches, so it runs in
+# worker processes. PARSE_WORKERS=0 parses in the server process instead.
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+_parse_executor: Optional[ProcessPoolExecutor] = None
+_parse_executor_lock = threading.Lock()
+
+# Bounds parses in flight (each holds a whole file in memory) to the worker count
+_parse_semaphore = asyncio.Semaphore(max(1, PARSE_WORKERS))
 
 # Module-level parser instances (expensive to create, reuse them)
 _docling_parser: Optional[DoclingParser] = None
@@ -35,7 +49,7 @@ def get_docling_parser() -> Optional[DoclingParser]:
         try:
             _docling_parser = DoclingParser()
         except Exception as e:
-            print(f"Warning: Failed to initialize DoclingParser: {e}")
+            logger.warning("Failed to initialize DoclingParser: %s", e)
             return None
     
     return _docling_parser
@@ -54,12 +68,83 @@ def get_paddleocr_parser() -> Optional[PaddleOCRParser]:
             from paddleocr import PaddleOCR
             _paddleocr_parser = PaddleOCRParser(pipeline=PaddleOCR())
         except Exception as e:
-            print(f"Warning: Failed to initialize PaddleOCRParser: {e}")
+            logger.warning("Failed to initialize PaddleOCRParser: %s", e)
             return None
     
     return _paddleocr_parser
 
 
+def _get_parse_executor() -> ProcessPoolExecutor:
+    """Return the parse worker pool, starting it on first use."""
+    global _parse_executor
+    
+    if _parse_executor is None:
+        with _parse_executor_lock:
+            if _parse_executor is None:
+                # spawn, not fork: parsers hold native (Paddle/torch) state that
+                # does not survive a fork of the threaded server process.
+                # Workers build each parser on the first file that needs it,
+                # so a PDF-only workload never loads the OCR models.
+                _parse_executor = ProcessPoolExecutor(
+                    max_workers=PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _parse_executor
+
+
+def _discard_parse_executor(executor: ProcessPoolExecutor) -> None:
+    """
+    Drop a pool that lost a worker (e.g. OOM-killed), so the next parse
+    starts a fresh one. A broken pool never accepts work again.
+    """
+    global _parse_executor
+    
+    with _parse_executor_lock:
+        if _parse_executor is executor:
+            _parse_executor = None
+    executor.shutdown(wait=False)
+
+
+def shutdown_executor() -> None:
+    """Stop the parse worker processes, if they were started."""
+    global _parse_executor
+    
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=True)
+        _parse_executor = None
+
+
+def _select_parser(file_type: str):
+    """Pick the parser for a file type in the current process."""
+    if file_type == "pdf":
+        # Try DoclingParser first (faster, no OCR needed for text PDFs)
+        parser = get_docling_parser()
+        if parser is None:
+            # Fallback to PaddleOCRParser if DoclingParser not available
+            parser = get_paddleocr_parser()
+    else:
+        # For images, use PaddleOCRParser
+        parser = get_paddleocr_parser()
+    
+    if parser is None:
+        raise RuntimeError(
+            "No Pathway parser available. Install pathway[llm] and required dependencies."
+        )
+    return parser
+
+
+def _parse_in_worker(
+    file_content: bytes,
+    file_type: str,
+    filename: str,
+    patient_id: int,
+    file_id: int,
+) -> dict:
+    """Parse one file inside a worker process (runs the async parser to completion)."""
+    parser = _select_parser(file_type)
+    return asyncio.run(_parse_file_async(parser, file_content, filename, patient_id, file_id))
+
+
 async def parse_file_with_pathway(
     file_content: bytes,
     file_type: str,
@@ -80,35 +165,37 @@ async def parse_file_with_pathway(
     Returns:
         Dictionary with parsed content and metadata
     """
-    loop = asyncio.get_event_loop()
-    
-    # Choose parser based on file type
-    if file_type == "pdf":
-        # Try DoclingParser first (faster, no OCR needed for text PDFs)
-        parser = get_docling_parser()
-        if parser is None:
-            # Fallback to PaddleOCRParser if DoclingParser not available
-            parser = get_paddleocr_parser()
-    else:
-        # For images, use PaddleOCRParser
-        parser = get_paddleocr_parser()
-    
-    if parser is None:
+    if not is_pathway_available():
         raise RuntimeError(
             "No Pathway parser available. Install pathway[llm] and required dependencies."
         )
     
-    # Parse file (Pathway parsers are async, so we can await directly)
     try:
-        # Pathway parsers are async UDFs - call them directly
-        parsed_result = await _parse_file_async(
-            parser,
-            file_content,
-            filename,
-            patient_id,
-            file_id,
-        )
-        return parsed_result
+        async with _parse_semaphore:
+            if PARSE_WORKERS == 0:
+                # Pathway parsers are async UDFs - call them directly
+                parser = _select_parser(file_type)
+                return await _parse_file_async(parser, file_content, filename, patient_id, file_id)
+            
+            loop = asyncio.get_running_loop()
+            # One retry on a fresh pool if a worker died mid-parse
+            for attempt in range(2):
+                executor = _get_parse_executor()
+                try:
+                    return await loop.run_in_executor(
+                        executor,
+                        _parse_in_worker,
+                        file_content,
+                        file_type,
+                        filename,
+                        patient_id,
+                        file_id,
+                    )
+                except BrokenProcessPool:
+                    _discard_parse_executor(executor)
+                    if attempt:
+                        raise
+                    logger.warning("Parse worker died, retrying file %s on a new pool", file_id)
     
     except Exception as e:
         raise RuntimeError(f"Failed to parse file with Pathway: {e}") from e
@@ -145,13 +232,13 @@ async def _parse_file_async(
             parsed_chunks = await parser.__wrapped__(file_content)
         
         # Combine all text chunks
-        extracted_text = "\n\n".join([chunk[0] for chunk in parsed_chunks if chunk[0]])
+        extracted_text = "\n\n".join(chunk[0] for chunk in parsed_chunks if chunk[0])
         
-        # Combine metadata from all chunks
+        # Use a copy of the first chunk's metadata as base; the chunk keeps
+        # its own dict, which is indexed as-is
         all_metadata = {}
-        if parsed_chunks:
-            # Use metadata from first chunk as base
-            all_metadata = parsed_chunks[0][1] if len(parsed_chunks[0]) > 1 else {}
+        if parsed_chunks and len(parsed_chunks[0]) > 1:
+            all_metadata = dict(parsed_chunks[0][1])
         
         # Add our custom metadata
         all_metadata.update({
@@ -165,7 +252,7 @@ async def _parse_file_async(
         return {
             'text': extracted_text,
             'metadata': all_metadata,
-            'chunks': parsed_chunks,  # Keep chunks for potential future use
+            'chunks': parsed_chunks,  # (text, metadata) pairs for the RAG index
         }
     
     except Exception as e:
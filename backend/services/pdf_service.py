@@ -7,14 +7,99 @@ Generates PDF documents from text summaries.
 from __future__ import annotations
 
 import io
-from typing import Optional
+import re
+from typing import BinaryIO, List, Optional, Tuple
 
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, ListFlowable
 from reportlab.lib.enums import TA_LEFT, TA_CENTER
 
+# Markdown emphasis, compiled once for every line of every PDF
+_BOLD_STAR_RE = re.compile(r'\*\*(.*?)\*\*')
+_BOLD_UNDERSCORE_RE = re.compile(r'__(.*?)__')
+_ITALIC_STAR_RE = re.compile(r'(?<!\*)\*(?!\*)(.*?)(?<!\*)\*(?!\*)')
+_ITALIC_UNDERSCORE_RE = re.compile(r'(?<!_)_(?!_)(.*?)(?<!_)_(?!_)')
+
+# Paragraph styles are immutable once built, so every PDF shares one set
+_STYLES = getSampleStyleSheet()
+
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=18,
+    textColor='#1a1a1a',
+    spaceAfter=30,
+    alignment=TA_CENTER,
+)
+
+_HEADING_STYLE = ParagraphStyle(
+    'CustomHeading',
+    parent=_STYLES['Heading2'],
+    fontSize=14,
+    textColor='#2c3e50',
+    spaceAfter=12,
+    spaceBefore=12,
+    alignment=TA_LEFT,
+)
+
+_BODY_STYLE = ParagraphStyle(
+    'CustomBody',
+    parent=_STYLES['Normal'],
+    fontSize=11,
+    textColor='#333333',
+    spaceAfter=6,
+    alignment=TA_LEFT,
+    leading=14,
+)
+
+# Page setup shared by every summary PDF
+_PAGE_LAYOUT = {
+    'pagesize': letter,
+    'rightMargin': 72,
+    'leftMargin': 72,
+    'topMargin': 72,
+    'bottomMargin': 72,
+}
+
+# Characters ReportLab's Paragraph markup would otherwise interpret
+_HTML_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+
+def _markdown_to_html(text: str) -> str:
+    """Convert markdown formatting to HTML for ReportLab Paragraph."""
+    # Escape first so only the tags added below are treated as markup
+    text = text.translate(_HTML_ESCAPES)
+    text = _BOLD_STAR_RE.sub(r'<b>\1</b>', text)
+    text = _BOLD_UNDERSCORE_RE.sub(r'<b>\1</b>', text)
+    text = _ITALIC_STAR_RE.sub(r'<i>\1</i>', text)
+    text = _ITALIC_UNDERSCORE_RE.sub(r'<i>\1</i>', text)
+    return text
+
+
+def _heading_text(text: str) -> str:
+    """Heading text with markdown emphasis markers dropped."""
+    text = text.strip().translate(_HTML_ESCAPES)
+    text = _BOLD_STAR_RE.sub(r'\1', text)
+    return _BOLD_UNDERSCORE_RE.sub(r'\1', text)
+
+
+def _classify_line(line: str) -> Tuple[str, str]:
+    """
+    Classify a stripped, non-empty summary line in one look at its first
+    character.
+    
+    Returns:
+        (kind, content) where kind is 'heading', 'bullet' or 'text'
+    """
+    first = line[0]
+    if first == '#':
+        return 'heading', _heading_text(line.lstrip('#'))
+    if first == '-' or first == '•':
+        return 'bullet', _markdown_to_html(line.lstrip('- •').strip())
+    return 'text', _markdown_to_html(line)
+
 
 def generate_summary_pdf(
     summary_text: str,
@@ -32,131 +117,71 @@ def generate_summary_pdf(
     Returns:
         PDF content as bytes
     """
-    # Create a BytesIO buffer to hold PDF
     buffer = io.BytesIO()
+    write_summary_pdf(buffer, summary_text, patient_name, specialist_type)
+    return buffer.getvalue()
+
+
+def write_summary_pdf(
+    fileobj: BinaryIO,
+    summary_text: str,
+    patient_name: Optional[str] = None,
+    specialist_type: str = "general",
+) -> None:
+    """
+    Render a summary PDF into any writable binary file object.
     
+    Args:
+        fileobj: Destination file object (e.g. a spooled temp file)
+        summary_text: The summary text to convert to PDF
+        patient_name: Optional patient name for header
+        specialist_type: Type of specialist for title
+    """
     # Create PDF document
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=letter,
-        rightMargin=72,
-        leftMargin=72,
-        topMargin=72,
-        bottomMargin=72,
-    )
+    doc = SimpleDocTemplate(fileobj, **_PAGE_LAYOUT)
     
     # Container for PDF content
     story = []
     
-    # Define styles
-    styles = getSampleStyleSheet()
-    
-    # Title style
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor='#1a1a1a',
-        spaceAfter=30,
-        alignment=TA_CENTER,
-    )
-    
-    # Heading style
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor='#2c3e50',
-        spaceAfter=12,
-        spaceBefore=12,
-        alignment=TA_LEFT,
-    )
-    
-    # Body style
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor='#333333',
-        spaceAfter=6,
-        alignment=TA_LEFT,
-        leading=14,
-    )
-    
     # Add title
     title = f"Patient Health Summary - {specialist_type.title()}"
-    story.append(Paragraph(title, title_style))
+    story.append(Paragraph(title, _TITLE_STYLE))
     story.append(Spacer(1, 0.2 * inch))
     
     # Add patient name if provided
     if patient_name:
-        patient_para = Paragraph(f"<b>Patient:</b> {patient_name}", body_style)
+        patient_para = Paragraph(f"<b>Patient:</b> {patient_name}", _BODY_STYLE)
         story.append(patient_para)
         story.append(Spacer(1, 0.1 * inch))
     
-    # Helper function to convert markdown to HTML for ReportLab
-    def markdown_to_html(text: str) -> str:
-        """Convert markdown formatting to HTML for ReportLab Paragraph."""
-        # Remove markdown bold (**text** or __text__)
-        import re
-        text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text)
-        text = re.sub(r'__(.*?)__', r'<b>\1</b>', text)
-        # Remove markdown italic (*text* or _text_)
-        text = re.sub(r'(?<!\*)\*(?!\*)(.*?)(?<!\*)\*(?!\*)', r'<i>\1</i>', text)
-        text = re.sub(r'(?<!_)_(?!_)(.*?)(?<!_)_(?!_)', r'<i>\1</i>', text)
-        # Escape HTML special characters
-        text = text.replace('&', '&amp;')
-        # But preserve our HTML tags
-        text = text.replace('&amp;lt;', '&lt;').replace('&amp;gt;', '&gt;')
-        text = text.replace('&lt;b&gt;', '<b>').replace('&lt;/b&gt;', '</b>')
-        text = text.replace('&lt;i&gt;', '<i>').replace('&lt;/i&gt;', '</i>')
-        return text
+    # Parse and add summary content; consecutive bullet lines become one list
+    bullets: List[Paragraph] = []
     
-    # Parse and add summary content
-    lines = summary_text.split('\n')
-    current_section = None
+    def flush_bullets() -> None:
+        if bullets:
+            story.append(ListFlowable(list(bullets), bulletType='bullet', start='•', leftIndent=12))
+            bullets.clear()
     
-    for line in lines:
+    for line in summary_text.split('\n'):
         line = line.strip()
         if not line:
+            flush_bullets()
             story.append(Spacer(1, 0.05 * inch))
             continue
         
-        # Check if line is a section header (starts with ## or is a heading)
-        if line.startswith('##'):
-            # Section header
-            section_title = line.replace('##', '').strip()
-            # Remove markdown from section title
-            section_title = section_title.replace('**', '').replace('__', '')
-            story.append(Spacer(1, 0.1 * inch))
-            story.append(Paragraph(section_title, heading_style))
-            current_section = section_title
-        elif line.startswith('#'):
-            # Main heading
-            heading = line.replace('#', '').strip()
-            heading = heading.replace('**', '').replace('__', '')
+        kind, content = _classify_line(line)
+        if kind == 'bullet':
+            bullets.append(Paragraph(content, _BODY_STYLE))
+            continue
+        
+        flush_bullets()
+        if kind == 'heading':
             story.append(Spacer(1, 0.1 * inch))
-            story.append(Paragraph(heading, heading_style))
-        elif line.startswith('-') or line.startswith('•'):
-            # Bullet point
-            bullet_text = line.lstrip('- •').strip()
-            # Convert markdown to HTML
-            bullet_text = markdown_to_html(bullet_text)
-            para = Paragraph(f"• {bullet_text}", body_style)
-            story.append(para)
+            story.append(Paragraph(content, _HEADING_STYLE))
         else:
-            # Regular paragraph
-            # Convert markdown to HTML
-            formatted_line = markdown_to_html(line)
-            para = Paragraph(formatted_line, body_style)
-            story.append(para)
+            story.append(Paragraph(content, _BODY_STYLE))
+    flush_bullets()
     
-    # Build PDF
+    # Build PDF (callers run this off the event loop)
     doc.build(story)
-    
-    # Get PDF bytes
-    pdf_bytes = buffer.getvalue()
-    buffer.close()
-    
-    return pdf_bytes
 
@@ -0,0 +1,258 @@
+# pyright: reportMissingImports=false
+"""
+Batch Summary Service.
+Pre-generates patient summaries (e.g. overnight, for the next day's specialist
+visits) through the OpenAI Batch API, which costs half as much as the online
+endpoint and has separate rate limits, in exchange for up to 24h turnaround.
+Results land in the ``summaries`` table for retrieval at visit time.
+
+Prompts are built from this process's RAG index, so schedule batches from the
+server process (or with RAG_INDEX_PATH set).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from psycopg.types.json import Jsonb
+
+from ..utils.db import get_async_connection
+from . import summary_service
+
+logger = logging.getLogger(__name__)
+
+# Seconds between batch status checks while a batch is running
+BATCH_POLL_INTERVAL = float(os.getenv("SUMMARY_BATCH_POLL_INTERVAL", "300"))
+
+# Consecutive failed status checks after which polling gives up; call
+# collect_batch (or its endpoint) to pick the batch up again later
+BATCH_POLL_MAX_FAILURES = 5
+
+# Batch states after which OpenAI will not change the batch any more
+_TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+
+# Strong references to polling tasks so they are not garbage collected
+_poll_tasks: set[asyncio.Task] = set()
+
+
+def _custom_id(patient_id: int) -> str:
+    return f"p{patient_id}"
+
+
+async def schedule_summaries(
+    patient_ids: List[int],
+    specialist_type: str = "general",
+    poll: bool = True,
+) -> Optional[str]:
+    """
+    Submit one summary request per patient as a single OpenAI batch.
+
+    Patients without indexed records are skipped. With ``poll`` set, a
+    background task collects the results once the batch finishes; otherwise
+    call collect_batch later (e.g. from the next scheduled run).
+
+    Args:
+        patient_ids: Patient/user IDs to summarize
+        specialist_type: Type of specialist the summaries are for
+        poll: Whether to poll for the results in this process
+
+    Returns:
+        The OpenAI batch ID, or None if there was nothing to submit
+    """
+    openai = summary_service.openai
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key or not openai:
+        logger.warning("OpenAI API not available - cannot schedule batch summaries")
+        return None
+
+    # Same prompt and parameters as the online summary call
+    lines = []
+    sources: Dict[int, List[Dict[str, Any]]] = {}
+    for patient_id in dict.fromkeys(patient_ids):
+        fallback, context = await summary_service._prepare_summary(
+            patient_id, specialist_type, None, None
+        )
+        if fallback is not None:
+            continue
+        sources[patient_id] = context["rag_result"]["sources"]
+        lines.append(json.dumps({
+            "custom_id": _custom_id(patient_id),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": context["model"],
+                "messages": summary_service._summary_messages(context["summary_prompt"]),
+                "temperature": 0.3,
+                "max_tokens": 2500,
+            },
+        }))
+
+    if not lines:
+        logger.info("No patients with records to summarize for %s", specialist_type)
+        return None
+
+    client = summary_service._openai_client(api_key)
+    input_file = await client.files.create(
+        file=("summaries.jsonl", "\n".join(lines).encode()),
+        purpose="batch",
+    )
+    batch = await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(
+                """
+                INSERT INTO summaries (patient_id, specialist_type, batch_id, status, sources)
+                VALUES (%s, %s, %s, 'pending', %s)
+                """,
+                [
+                    (patient_id, specialist_type, batch.id, Jsonb(patient_sources))
+                    for patient_id, patient_sources in sources.items()
+                ],
+            )
+
+    logger.info("Scheduled batch %s with %d %s summaries", batch.id, len(lines), specialist_type)
+
+    if poll:
+        task = asyncio.create_task(_poll_batch(batch.id))
+        _poll_tasks.add(task)
+        task.add_done_callback(_poll_tasks.discard)
+
+    return batch.id
+
+
+async def collect_batch(batch_id: str) -> str:
+    """
+    Check a batch once and store its results if it has finished.
+
+    Returns:
+        The batch status reported by OpenAI
+    """
+    client = summary_service._openai_client(os.getenv("OPENAI_API_KEY"))
+    batch = await client.batches.retrieve(batch_id)
+    if batch.status not in _TERMINAL_STATUSES:
+        return batch.status
+
+    # Completed batches can still contain failed requests; anything without
+    # a usable answer is marked failed below
+    summaries: Dict[int, str] = {}
+    if batch.output_file_id:
+        output = await client.files.content(batch.output_file_id)
+        for line in output.text.splitlines():
+            if not line:
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            summary_text = response["body"]["choices"][0]["message"]["content"]
+            if summary_text:
+                summaries[int(record["custom_id"][1:])] = summary_text
+
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT id, patient_id, specialist_type, sources
+                FROM summaries
+                WHERE batch_id = %s AND status = 'pending'
+                """,
+                (batch_id,),
+            )
+            rows = await cur.fetchall()
+
+            completed = []
+            for row in rows:
+                summary_text = summaries.get(row["patient_id"])
+                if summary_text is None:
+                    continue
+                result = summary_service._summary_result(
+                    summary_text,
+                    summary_service._parse_summary_sections(summary_text),
+                    {"sources": row["sources"]},
+                    row["specialist_type"],
+                )
+                completed.append((Jsonb(result), row["id"]))
+
+            await cur.executemany(
+                """
+                UPDATE summaries
+                SET status = 'completed', result = %s, updated_at = NOW()
+                WHERE id = %s
+                """,
+                completed,
+            )
+            await cur.execute(
+                """
+                UPDATE summaries
+                SET status = 'failed', updated_at = NOW()
+                WHERE batch_id = %s AND status = 'pending'
+                """,
+                (batch_id,),
+            )
+
+    logger.info(
+        "Batch %s %s: %d of %d summaries stored",
+        batch_id, batch.status, len(completed), len(rows),
+    )
+    return batch.status
+
+
+async def _poll_batch(batch_id: str) -> None:
+    """Collect a batch's results once OpenAI reports it finished."""
+    failures = 0
+    while True:
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        try:
+            status = await collect_batch(batch_id)
+        except Exception as e:
+            # A 4xx (unknown batch, revoked key) will not fix itself
+            status_code = getattr(e, "status_code", None)
+            if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+                logger.error("Stopped polling batch %s: %s", batch_id, e)
+                return
+            failures += 1
+            if failures >= BATCH_POLL_MAX_FAILURES:
+                logger.error("Stopped polling batch %s after %d failed checks: %s", batch_id, failures, e)
+                return
+            logger.warning("Checking batch %s failed, will retry: %s", batch_id, e)
+            continue
+        failures = 0
+        if status in _TERMINAL_STATUSES:
+            return
+
+
+async def get_batch_summary(patient_id: int, specialist_type: str = "general") -> Optional[Dict[str, Any]]:
+    """
+    Get the most recent pre-generated summary for a patient, as long as none
+    of the patient's files changed after its batch was scheduled.
+
+    Returns:
+        Summary result (same shape as generate_patient_summary), or None
+    """
+    async with get_async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT s.result
+                FROM summaries s
+                WHERE s.patient_id = %s AND s.specialist_type = %s AND s.status = 'completed'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM files f
+                      WHERE f.patient_id = s.patient_id AND f.updated_at > s.created_at
+                  )
+                ORDER BY s.updated_at DESC
+                LIMIT 1
+                """,
+                (patient_id, specialist_type),
+            )
+            row = await cur.fetchone()
+    return row["result"] if row else None
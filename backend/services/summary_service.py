@@ -6,8 +6,19 @@ Generates 1-2 page health summaries for specialists using Pathway RAG + LLM.
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import operator
 import os
-from typing import Optional, List, Dict, Any
+import re
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 try:
     from pathway.xpacks.llm.llms import OpenAIChat
@@ -16,61 +27,225 @@ except ImportError:
     OpenAIChat = None  # type: ignore
     openai = None  # type: ignore
 
-# Specialist-specific information extraction prompts
-SPECIALIST_PROMPTS = {
-    "dermatologist": """
-    Extract information relevant to dermatology:
-    - Skin conditions, rashes, lesions
-    - Dermatological diagnoses
-    - Skin-related medications
-    - Allergies (especially skin-related)
-    - Recent skin procedures or treatments
-    """,
-    "ophthalmologist": """
-    Extract information relevant to ophthalmology:
-    - Eye conditions, vision problems
-    - Eye-related diagnoses
-    - Eye medications
-    - Recent eye exams or procedures
-    - Vision-related symptoms
-    """,
-    "immunologist": """
-    Extract information relevant to immunology:
-    - Allergies and allergic reactions
-    - Immune system conditions
-    - Immunosuppressant medications
-    - Recent infections
-    - Autoimmune conditions
-    """,
-    "neurologist": """
-    Extract information relevant to neurology:
-    - Neurological symptoms
-    - Neurological diagnoses
-    - Neurological medications
-    - Headaches, seizures, cognitive issues
-    - Recent neurological exams
-    """,
-    "cardiologist": """
-    Extract information relevant to cardiology:
-    - Heart conditions
-    - Cardiovascular medications
-    - Blood pressure readings
-    - Cardiac test results
-    - Heart-related symptoms
-    """,
-    "general": """
-    Extract general medical information:
-    - Active medications
-    - Allergies
-    - Recent diagnoses
-    - Lab results
-    - Current symptoms
-    """,
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None  # type: ignore
+
+from . import embed_cache, pathway_rag_service
+
+logger = logging.getLogger(__name__)
+
+# Specialist-specific information extraction prompts, kept as data next to
+# this module so they can be edited without touching code
+SPECIALIST_PROMPTS: Dict[str, str] = json.loads(
+    Path(__file__).with_name("specialist_prompts.json").read_text(encoding="utf-8")
+)
+
+# Valid specialist_type values, for O(1) membership checks
+SPECIALISTS = frozenset(SPECIALIST_PROMPTS)
+
+SUMMARY_MODEL = "gpt-4o-mini"
+# Cheaper, faster model for short routine summaries. Specialists mapped to
+# it use it unless the request has a custom prompt or the prompt exceeds
+# LIGHT_MODEL_MAX_PROMPT_TOKENS; everything else gets SUMMARY_MODEL. The
+# cutoff is half of RECORDS_TOKENS, so the light model sees patients with a
+# few short documents, not ones whose records fill the prompt budget.
+LIGHT_SUMMARY_MODEL = "gpt-4.1-nano"
+LIGHT_MODEL_MAX_PROMPT_TOKENS = 2000
+MODEL_BY_SPECIALIST = {
+    "general": LIGHT_SUMMARY_MODEL,
+    "dermatologist": SUMMARY_MODEL,
+    "ophthalmologist": SUMMARY_MODEL,
+    "immunologist": SUMMARY_MODEL,
+    "neurologist": SUMMARY_MODEL,
+    "cardiologist": SUMMARY_MODEL,
 }
 
+# One RAG query serves both prompt sections: the top GENERAL_INFO_CHUNKS
+# chunks that mention demographics become the basic patient information,
+# the top RECORD_CHUNKS chunks overall become the medical records.
+GENERAL_INFO_CHUNKS = 5
+RECORD_CHUNKS = 20
+# Tokens of chunk text given to the LLM for each prompt section
+GENERAL_INFO_TOKENS = 800
+RECORDS_TOKENS = 4000
+# Token estimate used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+# A summary section header: a markdown heading, or a short all-caps line
+_SECTION_RE = re.compile(r"^(?:#+\s*(.*?)[\s#]*|(?=[^a-z]*[A-Z])([^a-z]{1,49}))$")
+
+_DEMOGRAPHIC_RE = re.compile(
+    r"\b(?:DOB|date of birth|born|age|aged|sex|gender|male|female|M\.?R\.?N)\b",
+    re.IGNORECASE,
+)
+
+# Summary prompt. Everything here is identical for every request, so it is
+# sent as the leading system message and stays byte-for-byte stable for
+# OpenAI's automatic prompt-prefix caching; the specialist, focus and
+# records follow in the user message.
+SUMMARY_SYSTEM_PROMPT = """You are a medical assistant creating patient health summaries. Always cite sources using [Source: filename] format. Never make diagnoses. Summarize and organize information clearly.
+
+You will be given the specialist, the visit focus, basic patient information and the patient's medical records. Each record excerpt is enclosed in <<DOC id>> and <<END>> lines. Create a concise patient health summary for that visit focus.
+
+CRITICAL RULES:
+1. Do NOT make diagnoses - only report what is in the source documents
+2. Do NOT provide medical recommendations or treatment advice
+3. Only include information explicitly stated in the source documents
+4. Cite sources using format: [Source: filename] at the end of each fact
+5. Keep summary concise and well-organized (1-2 pages maximum)
+6. Focus ONLY on information relevant to the given specialist
+7. Use clear section headers with ## (plain text, NO markdown formatting like **bold**)
+8. Use bullet points (•) for lists
+9. If information is not available, state "Not documented" rather than guessing
+10. DO NOT copy raw text - summarize and organize the information
+11. DO NOT use markdown formatting (no **bold**, no __bold__, no *italic*) - use plain text only
+
+Create a well-structured patient health summary. Start with a patient overview section, then include specialist-specific information:
+
+## Patient Overview
+• Extract and summarize: Patient name, age (or date of birth), gender
+• Provide a brief 2-3 sentence general health summary based on the records
+• Include chief complaint or reason for visit if available
+• Include [Source: filename] citation for each fact
+
+## Active Medications
+• List each medication with dosage and indication
+• Include [Source: filename] citation
+
+## Allergies
+• List all known allergies and reactions
+• Include [Source: filename] citation
+
+## Recent Diagnoses
+• List recent diagnoses relevant to the visit focus
+• Include dates if available
+• Include [Source: filename] citation
+
+## Lab Results (if relevant to the visit focus)
+• Include recent lab results with dates and values
+• Include [Source: filename] citation
+
+## Imaging Findings (if relevant to the visit focus)
+• Include recent imaging findings with dates
+• Include [Source: filename] citation
+
+## Current Symptoms
+• List current symptoms relevant to the visit focus
+• Include [Source: filename] citation
+
+## Relevant Medical History
+• Include relevant past medical history for the visit focus
+• Include [Source: filename] citation
+
+IMPORTANT: 
+- Start with the Patient Overview section (age, gender, general summary)
+- Then provide specialist-specific sections
+- Summarize and organize the information. Do NOT copy raw text verbatim
+- Create a clean, professional summary
+- Use plain text only (no markdown formatting)"""
+
+# Exact-match cache of generated summaries: key -> (expires_at, patient_id, result).
+# Entries for a patient are dropped as soon as a new document of theirs is
+# indexed; the TTL bounds staleness from changes made by other processes.
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "900"))
+SUMMARY_CACHE_MAX_ENTRIES = 512
+_summary_cache: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+
+# Opt-in semantic cache for free-form requests (custom query/prompt): a
+# request whose embedding is at least SEMANTIC_CACHE_THRESHOLD cosine-similar
+# to an earlier one for the same patient and specialist reuses its summary.
+# Costs one embedding call per miss, so it is off unless enabled.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_PER_KEY = 32
+# (patient_id, specialist_type) -> [(expires_at, unit embedding, result)], oldest first.
+# Entries are few per key, so a linear scan beats any index here. Embeddings
+# stay plain float lists: both dot products below read them faster than
+# array('f') buffers, which box every element on access.
+_semantic_cache: Dict[Tuple[int, str], List[Tuple[float, List[float], Dict[str, Any]]]] = {}
+
+# Dot product of two equal-length vectors, computed in C where available
+# (Python 3.12+)
+if hasattr(math, "sumprod"):
+    _dot = math.sumprod
+else:
+    def _dot(a, b) -> float:
+        return sum(map(operator.mul, a, b))
+
 
+# Last piece of a streamed summary that broke off after text was sent
+STREAM_ERROR_MARKER = "\n\n[ERROR: summary generation failed; this summary is incomplete]"
+
+# OpenAI request limits: seconds per attempt, and retries after connection
+# errors, 429s and 5xx responses (exponential backoff with jitter, done by
+# the SDK itself)
+OPENAI_TIMEOUT = 30.0
+OPENAI_MAX_RETRIES = 3
+
+# Circuit breaker: once OPENAI_BREAKER_FAILURES failed calls fall within
+# OPENAI_BREAKER_WINDOW seconds, calls fail fast for OPENAI_COOLDOWN seconds,
+# so an OpenAI outage turns into quick fallbacks instead of every request
+# sitting out its timeouts and retries
+OPENAI_BREAKER_FAILURES = 15
+OPENAI_BREAKER_WINDOW = 60.0
+OPENAI_COOLDOWN = 30.0
+# Times of the most recent failures, oldest first
+_openai_failures: "deque[float]" = deque(maxlen=OPENAI_BREAKER_FAILURES)
+_openai_open_until = 0.0
+
+
+class OpenAIUnavailableError(RuntimeError):
+    """Raised instead of calling OpenAI while the circuit breaker is open."""
+
+
+@lru_cache(maxsize=1)
+def _openai_client(api_key: str):
+    """Shared client, so every call reuses its pool of keep-alive connections."""
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        timeout=OPENAI_TIMEOUT,
+        max_retries=OPENAI_MAX_RETRIES,
+    )
+
+
+def _check_openai_breaker() -> None:
+    if time.monotonic() < _openai_open_until:
+        raise OpenAIUnavailableError("OpenAI circuit breaker is open")
+
+
+def _record_openai_failure(error: Exception) -> None:
+    """Count an outage-type failure (connection, timeout, 429, 5xx) toward the breaker."""
+    global _openai_open_until
+    
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return
+    elif not isinstance(error, openai.APIConnectionError):
+        return
+    
+    now = time.monotonic()
+    _openai_failures.append(now)
+    if len(_openai_failures) == OPENAI_BREAKER_FAILURES and _openai_failures[0] > now - OPENAI_BREAKER_WINDOW:
+        _openai_open_until = now + OPENAI_COOLDOWN
+        _openai_failures.clear()
+        logger.error("OpenAI failing repeatedly; skipping calls for %.0f seconds", OPENAI_COOLDOWN)
+
+
+async def _openai_chat(api_key: str, **kwargs: Any) -> Any:
+    """chat.completions.create with timeouts, retries and the circuit breaker."""
+    _check_openai_breaker()
+    try:
+        return await _openai_client(api_key).chat.completions.create(**kwargs)
+    except Exception as e:
+        _record_openai_failure(e)
+        raise
+
+
+@lru_cache(maxsize=1)
 def get_llm_instance() -> Optional[OpenAIChat]:
-    """Get or create OpenAI LLM instance for summary generation."""
+    """Get the OpenAI LLM instance for summary generation, created on first use."""
     if OpenAIChat is None:
         return None
     
@@ -85,8 +260,68 @@ def get_llm_instance() -> Optional[OpenAIChat]:
             temperature=0.3,  # Lower temperature for more factual summaries
         )
     except Exception as e:
-        print(f"Warning: Failed to initialize LLM: {e}")
+        logger.warning("Failed to initialize LLM: %s", e)
+        return None
+
+
+def _summary_cache_key(
+    patient_id: int,
+    specialist_type: str,
+    query_text: Optional[str],
+    custom_prompt: Optional[str],
+) -> str:
+    # No model in the key: _pick_model routes on the prompt, which is only
+    # built after the lookup. Routing is fixed by these inputs plus the
+    # patient's documents, and a new document invalidates the patient's
+    # entries, so a key always maps to one model. Changing the model table
+    # means a restart, which empties this in-process cache.
+    payload = json.dumps([patient_id, specialist_type, query_text, custom_prompt])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def invalidate_patient_cache(patient_id: int) -> None:
+    """Drop cached summaries for a patient, e.g. after a new document is indexed."""
+    stale = [key for key, (_, pid, _) in _summary_cache.items() if pid == patient_id]
+    for key in stale:
+        del _summary_cache[key]
+    for bucket in [bucket for bucket in _semantic_cache if bucket[0] == patient_id]:
+        del _semantic_cache[bucket]
+
+
+async def _embed_request(query_text: Optional[str], custom_prompt: Optional[str]) -> Optional[List[float]]:
+    """Unit-length embedding of a free-form request, or None if unavailable."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key or not openai:
+        return None
+    
+    try:
+        _check_openai_breaker()
+        vector = await embed_cache.embed(_openai_client(api_key), f"{query_text or ''}\n{custom_prompt or ''}")
+    except Exception as e:
+        _record_openai_failure(e)
+        logger.warning("Embedding request failed, skipping semantic cache: %s", e)
         return None
+    
+    norm = math.sqrt(_dot(vector, vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def _semantic_cache_lookup(bucket: Tuple[int, str], embedding: List[float]) -> Optional[Dict[str, Any]]:
+    """Most similar live entry at or above the threshold, if any."""
+    now = time.monotonic()
+    entries = [entry for entry in _semantic_cache.get(bucket, ()) if entry[0] > now]
+    if not entries:
+        _semantic_cache.pop(bucket, None)
+        return None
+    _semantic_cache[bucket] = entries
+    
+    # Cosine similarity is a plain dot product on unit vectors
+    best_score, best_result = max(
+        ((_dot(cached_embedding, embedding), result)
+         for _, cached_embedding, result in entries),
+        key=operator.itemgetter(0),
+    )
+    return best_result if best_score >= SEMANTIC_CACHE_THRESHOLD else None
 
 
 async def generate_patient_summary(
@@ -97,6 +332,9 @@ async def generate_patient_summary(
 ) -> Dict[str, Any]:
     """
     Generate a patient health summary for a specific specialist.
+    Repeat requests with the same inputs (or, with the semantic cache on, a
+    near-identical custom query/prompt) are served from an in-process cache
+    until it expires or the patient gets a new document.
     
     Args:
         patient_id: Patient/user ID
@@ -107,19 +345,252 @@ async def generate_patient_summary(
     Returns:
         Dictionary with summary, sections, and citations
     """
-    from . import pathway_rag_service
-    from ..utils.db import get_connection
-    
-    # Get patient basic info from database
-    patient_name = None
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT full_name FROM users WHERE id = %s", (patient_id,))
-            row = cur.fetchone()
-            if row:
-                patient_name = row["full_name"]
-    
-    # First, get general patient information (age, gender, basic demographics)
+    key = _summary_cache_key(patient_id, specialist_type, query_text, custom_prompt)
+    cached = _get_cached_summary(key)
+    if cached is not None:
+        return cached
+    
+    embedding = None
+    bucket = (patient_id, specialist_type)
+    if SEMANTIC_CACHE_ENABLED and (query_text or custom_prompt):
+        embedding = await _embed_request(query_text, custom_prompt)
+        if embedding is not None:
+            similar = _semantic_cache_lookup(bucket, embedding)
+            if similar is not None:
+                return similar
+    
+    result, cacheable = await _generate_patient_summary(
+        patient_id, specialist_type, query_text, custom_prompt
+    )
+    
+    # Only LLM-written summaries are worth keeping; fallbacks are cheap to redo
+    if cacheable:
+        _cache_summary(key, patient_id, result, bucket, embedding)
+    
+    return result
+
+
+async def generate_patient_summary_stream(
+    patient_id: int,
+    specialist_type: str = "general",
+    query_text: Optional[str] = None,
+    custom_prompt: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of generate_patient_summary: yields the summary text
+    as the LLM produces it. Cached summaries and fallbacks (no records, no
+    LLM) are yielded in one piece. The completed text is cached for both
+    variants; the optional quality check is skipped, since text already sent
+    cannot be revised.
+    
+    Yields:
+        Pieces of summary text
+    """
+    key = _summary_cache_key(patient_id, specialist_type, query_text, custom_prompt)
+    cached = _get_cached_summary(key)
+    if cached is not None:
+        yield cached["summary"]
+        return
+    
+    fallback, context = await _prepare_summary(patient_id, specialist_type, query_text, custom_prompt)
+    if fallback is not None:
+        yield fallback["summary"]
+        return
+    
+    parts: List[str] = []
+    try:
+        logger.info("Streaming OpenAI summary for %s", specialist_type)
+        stream = await _openai_chat(
+            context["api_key"],
+            model=context["model"],
+            messages=_summary_messages(context["summary_prompt"]),
+            temperature=0.3,
+            max_tokens=2500,
+            stream=True,
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    except Exception as e:
+        logger.error("Error streaming from OpenAI API: %s", e)
+        if not parts:
+            yield _join_chunks(context["rag_result"]["retrieved_chunks"])
+        else:
+            # The 200 status is already sent; end with a marker so clients
+            # can tell this partial summary from a complete one
+            yield STREAM_ERROR_MARKER
+        return
+    
+    if not parts:
+        logger.warning("OpenAI returned empty response, using retrieved text")
+        yield _join_chunks(context["rag_result"]["retrieved_chunks"])
+        return
+    
+    summary_text = "".join(parts)
+    logger.info("Generated summary (%d characters)", len(summary_text))
+    sections = _parse_summary_sections(summary_text)
+    _cache_summary(key, patient_id, _summary_result(
+        summary_text, sections, context["rag_result"], specialist_type, context["num_tokens_in"]
+    ))
+
+
+def _get_cached_summary(key: str) -> Optional[Dict[str, Any]]:
+    """Live exact-match cache entry for ``key``, if any."""
+    cached = _summary_cache.get(key)
+    if cached is None:
+        return None
+    if cached[0] <= time.monotonic():
+        del _summary_cache[key]
+        return None
+    _summary_cache.move_to_end(key)
+    return cached[2]
+
+
+def _cache_summary(
+    key: str,
+    patient_id: int,
+    result: Dict[str, Any],
+    bucket: Optional[Tuple[int, str]] = None,
+    embedding: Optional[List[float]] = None,
+) -> None:
+    """Store an LLM-written summary in the exact (and, with an embedding, semantic) cache."""
+    if SUMMARY_CACHE_TTL <= 0:
+        return
+    
+    expires_at = time.monotonic() + SUMMARY_CACHE_TTL
+    _summary_cache[key] = (expires_at, patient_id, result)
+    _summary_cache.move_to_end(key)
+    if len(_summary_cache) > SUMMARY_CACHE_MAX_ENTRIES:
+        _summary_cache.popitem(last=False)
+    
+    if bucket is not None and embedding is not None:
+        entries = _semantic_cache.setdefault(bucket, [])
+        entries.append((expires_at, embedding, result))
+        del entries[:-SEMANTIC_CACHE_MAX_PER_KEY]
+
+
+def _pick_model(specialist_type: str, prompt_tokens: int, has_custom_prompt: bool) -> str:
+    """Model for a summary request, given its size in tokens and specialist."""
+    if has_custom_prompt or prompt_tokens > LIGHT_MODEL_MAX_PROMPT_TOKENS:
+        return SUMMARY_MODEL
+    return MODEL_BY_SPECIALIST.get(specialist_type.lower(), SUMMARY_MODEL)
+
+
+def _summary_messages(summary_prompt: str) -> List[Dict[str, str]]:
+    """Chat messages for a summary request: static instructions, then the request data."""
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": summary_prompt},
+    ]
+
+
+def _chunk_header(chunk: Dict[str, Any]) -> str:
+    return f"[Source: {chunk.get('filename', 'Unknown')}]\n"
+
+
+def _join_chunks(chunks: List[Dict[str, Any]]) -> str:
+    """All chunks with their source lines, for showing retrieved text as-is."""
+    return "\n\n".join(_chunk_header(chunk) + chunk["text"] for chunk in chunks)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """Tokenizer of the summary models, or None to estimate from characters."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(SUMMARY_MODEL)
+    except Exception as e:
+        logger.warning("Tokenizer unavailable, estimating tokens from characters: %s", e)
+        return None
+
+
+def _count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of ``text`` that fits in ``max_tokens`` tokens."""
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text)
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def _doc_block(chunk: Dict[str, Any], text: str) -> str:
+    return f"<<DOC {chunk['file_id']}>>\n{_chunk_header(chunk)}{text}\n<<END>>"
+
+
+def _concat_budget(chunks: List[Dict[str, Any]], budget: int) -> str:
+    """
+    Prompt text for the best-ranked chunks that fit in ``budget`` tokens,
+    the last one cut short if needed. The chosen chunks are laid out in
+    file/chunk order, each between explicit markers, so requests that
+    retrieve the same chunks produce the same prompt whatever their ranking.
+    """
+    picked: List[Tuple[Dict[str, Any], str]] = []
+    remaining = budget
+    for chunk in chunks:
+        # Markers, source line and the blank line separating blocks
+        overhead = _count_tokens(_doc_block(chunk, "") + "\n\n")
+        if remaining <= overhead:
+            break
+        text = chunk["text"]
+        text_tokens = _count_tokens(text)
+        if text_tokens > remaining - overhead:
+            text = _truncate_tokens(text, remaining - overhead)
+            text_tokens = remaining - overhead
+        picked.append((chunk, text))
+        remaining -= overhead + text_tokens
+    
+    picked.sort(key=lambda item: (item[0]["file_id"], item[0]["chunk_index"]))
+    return "\n\n".join(_doc_block(chunk, text) for chunk, text in picked)
+
+
+def _summary_result(
+    summary_text: str,
+    sections: Dict[str, str],
+    rag_result: Dict[str, Any],
+    specialist_type: str,
+    num_tokens_in: Optional[int] = None,
+) -> Dict[str, Any]:
+    result = {
+        "summary": summary_text,
+        "sections": sections,
+        "sources": rag_result["sources"],
+        "specialist_type": specialist_type,
+        "num_sources": len(rag_result["sources"]),
+    }
+    if num_tokens_in is not None:
+        result["num_tokens_in"] = num_tokens_in
+    return result
+
+
+async def _prepare_summary(
+    patient_id: int,
+    specialist_type: str,
+    query_text: Optional[str],
+    custom_prompt: Optional[str],
+) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Retrieve the records and build the LLM prompt for a summary.
+    
+    Returns:
+        (fallback result, context). The fallback result is set when there is
+        nothing for the LLM to do (no records, or no LLM available); otherwise
+        it is None and context holds the rag_result, summary_prompt, model,
+        num_tokens_in and api_key for the LLM call.
+    """
+    # General patient information (age, gender, basic demographics), asked
+    # for by the built-in specialist query
     general_query = """
     Extract patient basic information:
     - Patient name
@@ -129,12 +600,6 @@ async def generate_patient_summary(
     - Chief complaint or reason for visit
     """
     
-    general_rag_result = await pathway_rag_service.query_rag(
-        query=general_query,
-        patient_id=patient_id,
-        top_k=5,  # Just a few chunks for basic info
-    )
-    
     # Get specialist-specific extraction prompt
     specialist_prompt = SPECIALIST_PROMPTS.get(
         specialist_type.lower(), 
@@ -160,7 +625,9 @@ async def generate_patient_summary(
         - Relevant medical history
         """
     else:
-        query = f"""
+        # The built-in query also asks for the basic information; added to
+        # a caller's query, these terms would outweigh it in the ranking
+        query = f"""{general_query}
         Extract all relevant medical information for a {specialist_type} visit:
         {specialist_prompt}
         
@@ -174,12 +641,31 @@ async def generate_patient_summary(
         - Relevant medical history
         """
     
-    # Query Pathway RAG to get relevant information
-    rag_result = await pathway_rag_service.query_rag(
+    # Query Pathway RAG once for basic info and specialist-relevant records,
+    # then split the ranked chunks locally
+    combined_result = await pathway_rag_service.query_rag(
         query=query,
         patient_id=patient_id,
-        top_k=20,  # Get more chunks for comprehensive summary
+        top_k=GENERAL_INFO_CHUNKS + RECORD_CHUNKS,
     )
+    retrieved_chunks = combined_result.get("retrieved_chunks", [])
+    retrieved_sources = combined_result.get("sources", [])
+    
+    # The top demographic chunks become the basic information and are left
+    # out of the records, so no chunk is sent twice. At least one chunk
+    # always stays a record.
+    general_positions = [
+        i for i, chunk in enumerate(retrieved_chunks) if _DEMOGRAPHIC_RE.search(chunk["text"])
+    ][:min(GENERAL_INFO_CHUNKS, len(retrieved_chunks) - 1)]
+    general_chunks = [retrieved_chunks[i] for i in general_positions]
+    record_positions = [
+        i for i in range(len(retrieved_chunks)) if i not in general_positions
+    ][:RECORD_CHUNKS]
+    rag_result = {
+        **combined_result,
+        "retrieved_chunks": [retrieved_chunks[i] for i in record_positions],
+        "sources": [retrieved_sources[i] for i in record_positions],
+    }
     
     if not rag_result.get("retrieved_chunks"):
         return {
@@ -187,156 +673,116 @@ async def generate_patient_summary(
             "sections": {},
             "sources": [],
             "specialist_type": specialist_type,
-        }
-    
-    # Combine general patient info
-    general_info_text = "\n\n".join([
-        f"[Source: {chunk.get('filename', 'Unknown')}]\n{chunk['text']}"
-        for chunk in general_rag_result.get("retrieved_chunks", [])
-    ])
-    
-    # Combine retrieved text (clean format for LLM)
-    retrieved_text = "\n\n".join([
-        f"[Source: {chunk.get('filename', 'Unknown')}]\n{chunk['text']}"
-        for chunk in rag_result["retrieved_chunks"]
-    ])
+        }, {}
     
     # Check if OpenAI API is available
     api_key = os.getenv("OPENAI_API_KEY")
     
     if not api_key or not openai:
         # Fallback: Return retrieved text if LLM not available
-        print("⚠️  Warning: OpenAI API not available - returning raw retrieved text")
+        logger.warning("OpenAI API not available - returning raw retrieved text")
+        retrieved_text = _join_chunks(rag_result["retrieved_chunks"])
         return {
             "summary": retrieved_text,
             "sections": _extract_sections_fallback(retrieved_text),
             "sources": rag_result["sources"],
             "specialist_type": specialist_type,
             "note": "LLM not available - showing raw retrieved text",
-        }
+        }, {}
     
     # Determine the focus for summary (custom prompt or specialist type)
     summary_focus = custom_prompt if custom_prompt else f"{specialist_type} visit"
     
-    # Generate summary with LLM - improved prompt
-    summary_prompt = f"""You are a medical assistant creating a concise patient health summary for a {summary_focus}.
-
-CRITICAL RULES:
-1. Do NOT make diagnoses - only report what is in the source documents
-2. Do NOT provide medical recommendations or treatment advice
-3. Only include information explicitly stated in the source documents
-4. Cite sources using format: [Source: filename] at the end of each fact
-5. Keep summary concise and well-organized (1-2 pages maximum)
-6. Focus ONLY on information relevant to {specialist_type}
-7. Use clear section headers with ## (plain text, NO markdown formatting like **bold**)
-8. Use bullet points (•) for lists
-9. If information is not available, state "Not documented" rather than guessing
-10. DO NOT copy raw text - summarize and organize the information
-11. DO NOT use markdown formatting (no **bold**, no __bold__, no *italic*) - use plain text only
+    # Static instructions go first (system message) and only the per-request
+    # data follows, so the provider can reuse its cached prompt prefix.
+    # Only as much chunk text as fits the token budgets is copied.
+    summary_prompt = f"""Specialist: {specialist_type}
+Visit focus: {summary_focus}
 
 Patient Basic Information:
-{general_info_text[:2000]}
+{_concat_budget(general_chunks, GENERAL_INFO_TOKENS)}
 
 Patient Medical Records:
-{retrieved_text[:6000]}
-
-Create a well-structured patient health summary. Start with a patient overview section, then include specialist-specific information:
-
-## Patient Overview
-• Extract and summarize: Patient name, age (or date of birth), gender
-• Provide a brief 2-3 sentence general health summary based on the records
-• Include chief complaint or reason for visit if available
-• Include [Source: filename] citation for each fact
-
-## Active Medications
-• List each medication with dosage and indication
-• Include [Source: filename] citation
-
-## Allergies
-• List all known allergies and reactions
-• Include [Source: filename] citation
-
-## Recent Diagnoses
-• List recent diagnoses relevant to {summary_focus}
-• Include dates if available
-• Include [Source: filename] citation
-
-## Lab Results (if relevant to {summary_focus})
-• Include recent lab results with dates and values
-• Include [Source: filename] citation
-
-## Imaging Findings (if relevant to {summary_focus})
-• Include recent imaging findings with dates
-• Include [Source: filename] citation
-
-## Current Symptoms
-• List current symptoms relevant to {summary_focus}
-• Include [Source: filename] citation
+{_concat_budget(rag_result["retrieved_chunks"], RECORDS_TOKENS)}"""
+    
+    prompt_tokens = _count_tokens(summary_prompt)
+    return None, {
+        "rag_result": rag_result,
+        "summary_prompt": summary_prompt,
+        "model": _pick_model(specialist_type, prompt_tokens, bool(custom_prompt)),
+        "num_tokens_in": _count_tokens(SUMMARY_SYSTEM_PROMPT) + prompt_tokens,
+        "api_key": api_key,
+    }
 
-## Relevant Medical History
-• Include relevant past medical history for {summary_focus}
-• Include [Source: filename] citation
 
-IMPORTANT: 
-- Start with the Patient Overview section (age, gender, general summary)
-- Then provide specialist-specific sections
-- Summarize and organize the information. Do NOT copy raw text verbatim
-- Create a clean, professional summary
-- Use plain text only (no markdown formatting)"""
+async def _generate_patient_summary(
+    patient_id: int,
+    specialist_type: str,
+    query_text: Optional[str],
+    custom_prompt: Optional[str],
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Build a summary without the cache.
+    
+    Returns:
+        (summary result, whether it was written by the LLM)
+    """
+    fallback, context = await _prepare_summary(patient_id, specialist_type, query_text, custom_prompt)
+    if fallback is not None:
+        return fallback, False
     
+    rag_result = context["rag_result"]
+    
+    llm_written = False
     try:
         # Generate summary using OpenAI API directly
-        print(f"🤖 Calling OpenAI API to generate summary for {specialist_type}...")
-        client = openai.AsyncOpenAI(api_key=api_key)
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a medical assistant creating patient health summaries. Always cite sources using [Source: filename] format. Never make diagnoses. Summarize and organize information clearly."
-                },
-                {
-                    "role": "user", 
-                    "content": summary_prompt
-                }
-            ],
+        logger.info("Calling OpenAI API to generate summary for %s", specialist_type)
+        response = await _openai_chat(
+            context["api_key"],
+            model=context["model"],
+            messages=_summary_messages(context["summary_prompt"]),
             temperature=0.3,
             max_tokens=2500,  # Increased for better summaries
         )
         
         summary_text = response.choices[0].message.content
         if not summary_text:
-            print("⚠️  Warning: OpenAI returned empty response, using retrieved text")
-            summary_text = retrieved_text
+            logger.warning("OpenAI returned empty response, using retrieved text")
+            summary_text = _join_chunks(rag_result["retrieved_chunks"])
         else:
-            print(f"✅ Successfully generated summary ({len(summary_text)} characters)")
+            logger.info("Generated summary (%d characters)", len(summary_text))
+            llm_written = True
         
     except Exception as e:
-        print(f"❌ Error calling OpenAI API: {e}")
+        logger.error("Error calling OpenAI API: %s", e)
         # Fallback to retrieved text
-        summary_text = retrieved_text
+        summary_text = _join_chunks(rag_result["retrieved_chunks"])
     
     # Optional: Quality check (if time permits)
     # Verify each statement is supported by sources
+    quality_check = None
     if os.getenv("ENABLE_QUALITY_CHECK", "false").lower() == "true":
-        try:
-            summary_text = await _quality_check_summary(
-                summary_text, 
-                rag_result["retrieved_chunks"],
-            )
-        except Exception as e:
-            print(f"Quality check failed: {e}")
+        quality_check = asyncio.create_task(
+            _quality_check_summary(summary_text, rag_result["retrieved_chunks"], model=context["model"])
+        )
     
-    # Extract sections from summary
+    # Extract sections from summary while the quality check (if any) runs
     sections = _parse_summary_sections(summary_text)
     
-    return {
-        "summary": summary_text,
-        "sections": sections,
-        "sources": rag_result["sources"],
-        "specialist_type": specialist_type,
-        "num_sources": len(rag_result["sources"]),
-    }
+    if quality_check is not None:
+        try:
+            verified_text = await quality_check
+        except Exception as e:
+            logger.warning("Quality check failed: %s", e)
+        else:
+            # Only re-parse if the verifier actually changed the text
+            if verified_text != summary_text:
+                summary_text = verified_text
+                sections = _parse_summary_sections(summary_text)
+    
+    return _summary_result(
+        summary_text, sections, rag_result, specialist_type, context["num_tokens_in"]
+    ), llm_written
 
 
 def _parse_summary_sections(summary_text: str) -> Dict[str, str]:
@@ -349,40 +795,24 @@ def _parse_summary_sections(summary_text: str) -> Dict[str, str]:
     Returns:
         Dictionary with section names and content
     """
-    sections = {}
-    current_section = None
-    current_content = []
+    # Lines before the first header go under "introduction"; a repeated
+    # header continues its earlier section
+    sections: Dict[str, List[str]] = {}
+    current_section = "introduction"
     
-    lines = summary_text.split("\n")
-    
-    for line in lines:
+    for line in summary_text.splitlines():
         line = line.strip()
         if not line:
             continue
         
-        # Check if line is a section header
-        if line.startswith("#") or (line.isupper() and len(line) < 50):
-            # Save previous section
-            if current_section:
-                sections[current_section] = "\n".join(current_content)
-            
-            # Start new section
-            current_section = line.replace("#", "").strip()
-            current_content = []
+        header = _SECTION_RE.match(line)
+        if header:
+            current_section = (header.group(2) or header.group(1)).strip()
+            sections.setdefault(current_section, [])
         else:
-            if current_section:
-                current_content.append(line)
-            else:
-                # Content before first section
-                if "introduction" not in sections:
-                    sections["introduction"] = []
-                sections.setdefault("introduction", []).append(line)
-    
-    # Save last section
-    if current_section:
-        sections[current_section] = "\n".join(current_content)
+            sections.setdefault(current_section, []).append(line)
     
-    return sections
+    return {name: "\n".join(content) for name, content in sections.items()}
 
 
 def _extract_sections_fallback(text: str) -> Dict[str, str]:
@@ -397,6 +827,7 @@ async def _quality_check_summary(
     summary_text: str,
     source_chunks: List[Dict[str, Any]],
     llm: Optional[Any] = None,
+    model: str = SUMMARY_MODEL,
 ) -> str:
     """
     Quality check: Verify each statement in summary is supported by sources.
@@ -406,6 +837,7 @@ async def _quality_check_summary(
         summary_text: Generated summary
         source_chunks: Source document chunks
         llm: LLM instance for verification
+        model: OpenAI model for verification (the one that wrote the summary)
     
     Returns:
         Verified summary (or original if verification fails)
@@ -432,9 +864,9 @@ async def _quality_check_summary(
         # Use OpenAI API directly if available
         api_key = os.getenv("OPENAI_API_KEY")
         if api_key and openai:
-            client = openai.AsyncOpenAI(api_key=api_key)
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
+            response = await _openai_chat(
+                api_key,
+                model=model,
                 messages=[
                     {"role": "system", "content": "You are a medical document verifier. Check that all statements are supported by sources."},
                     {"role": "user", "content": quality_check_prompt}
@@ -452,7 +884,7 @@ async def _quality_check_summary(
         return verified_summary
     
     except Exception as e:
-        print(f"Quality check failed: {e}")
+        logger.warning("Quality check failed: %s", e)
         return summary_text  # Return original if check fails
 
 
@@ -3,13 +3,16 @@
 
 from __future__ import annotations
 
+import asyncio
 import os
-from contextlib import contextmanager
+import threading
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from typing import Iterator
+from typing import AsyncIterator, Iterator, Optional
 
 import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 
 
 DATABASE_URL = os.getenv(
@@ -24,16 +27,96 @@ def _ensure_database_url() -> str:
     return DATABASE_URL
 
 
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "4"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "32"))
+
+# Server-side prepare any statement once it has run this many times on a
+# connection (psycopg's default is 5). Set DB_PREPARE_THRESHOLD=none to
+# disable, e.g. behind PgBouncer in transaction pooling mode.
+_prepare_threshold = os.getenv("DB_PREPARE_THRESHOLD", "1")
+PREPARE_THRESHOLD = None if _prepare_threshold.lower() in ("", "none") else int(_prepare_threshold)
+
+# Settings applied to every pooled connection
+_CONNECTION_KWARGS = {
+    "autocommit": True,
+    "row_factory": dict_row,
+    "prepare_threshold": PREPARE_THRESHOLD,
+}
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+_async_pool: Optional[AsyncConnectionPool] = None
+_async_pool_lock = asyncio.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool, opening it on first use."""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    conninfo=_ensure_database_url(),
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    kwargs=_CONNECTION_KWARGS,
+                    open=True,
+                )
+    return _pool
+
+
 @contextmanager
 def get_connection() -> Iterator[psycopg.Connection]:
-    """Yield a psycopg3 connection."""
-    conn = psycopg.connect(
-        _ensure_database_url(), autocommit=True, row_factory=dict_row
-    )
-    try:
+    """Yield a pooled psycopg3 connection."""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """Return the process-wide async connection pool, opening it on first use."""
+    global _async_pool
+
+    if _async_pool is None:
+        async with _async_pool_lock:
+            if _async_pool is None:
+                pool = AsyncConnectionPool(
+                    conninfo=_ensure_database_url(),
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    kwargs=_CONNECTION_KWARGS,
+                    open=False,
+                )
+                await pool.open()
+                _async_pool = pool
+    return _async_pool
+
+
+@asynccontextmanager
+async def get_async_connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    """Yield a pooled async psycopg3 connection."""
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
         yield conn
-    finally:
-        conn.close()
+
+
+async def open_pools() -> None:
+    """Open the sync and async pools and wait until their minimum connections are up."""
+    await asyncio.to_thread(get_pool().wait)
+    await (await get_async_pool()).wait()
+
+
+async def close_pools() -> None:
+    """Close both connection pools, if they were opened."""
+    global _pool, _async_pool
+
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+    if _pool is not None:
+        await asyncio.to_thread(_pool.close)
+        _pool = None
 
 
 def init_db(schema_path: Path | None = None) -> None:
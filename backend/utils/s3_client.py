@@ -3,11 +3,19 @@
 
 from __future__ import annotations
 
+import asyncio
+import io
 import os
-from functools import lru_cache
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from typing import BinaryIO
 
 import boto3
+from cachetools import TTLCache
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 
@@ -17,12 +25,50 @@ AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
+# Multipart settings for uploads and downloads: 8MB parts, up to
+# S3_TRANSFER_CONCURRENCY parts in flight per transfer. Buffered parts are
+# capped at the same number, so a transfer holds at most
+# concurrency * part size in memory.
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", "4"))
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_CHUNK_SIZE,
+    multipart_chunksize=MULTIPART_CHUNK_SIZE,
+    max_concurrency=TRANSFER_CONCURRENCY,
+    use_threads=True,
+)
+TRANSFER_CONFIG.max_in_memory_upload_chunks = TRANSFER_CONCURRENCY
+
+# HTTP connections the shared client keeps open. Every multipart worker of
+# every concurrent transfer needs its own, so the default of 10 would make
+# parallel uploads queue for connections.
+MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    s3={"addressing_style": "virtual"},
+)
+
+# Threads that run blocking S3 calls for async callers, one per pooled
+# connection, so S3 I/O never waits on threads busy with other work
+_s3_executor = ThreadPoolExecutor(max_workers=MAX_POOL_CONNECTIONS, thread_name_prefix="s3")
+
+# Keys recently seen to exist, so repeated file_exists checks skip the HEAD
+# request. Only hits are cached: a key missing now (e.g. a direct upload
+# still in progress) must be seen as soon as it appears.
+_exists_cache: TTLCache = TTLCache(maxsize=4096, ttl=30)
+_exists_lock = threading.Lock()
+
+# Lifetime of presigned PUT URLs handed to clients for direct uploads
+PRESIGNED_URL_EXPIRES_IN = int(os.getenv("S3_PRESIGNED_URL_EXPIRES_IN", "900"))
+
 
 @lru_cache()
 def get_s3_client():
     """
     Get a cached S3 client instance.
-    Uses credentials from environment variables.
+    Uses credentials from environment variables. The one client (and its
+    connection pool) is shared by every upload and download in the process.
     """
     if not AWS_ACCESS_KEY_ID or not AWS_SECRET_ACCESS_KEY:
         raise RuntimeError(
@@ -34,6 +80,7 @@ def get_s3_client():
         aws_access_key_id=AWS_ACCESS_KEY_ID,
         aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
         region_name=AWS_REGION,
+        config=CLIENT_CONFIG,
     )
 
 
@@ -58,6 +105,11 @@ def upload_file(
     Raises:
         ClientError: If upload fails
     """
+    # Large payloads go through the transfer manager as parallel multipart
+    # uploads; below the threshold a single PUT is one round trip cheaper
+    if len(file_content) >= MULTIPART_CHUNK_SIZE:
+        return upload_fileobj(io.BytesIO(file_content), s3_key, content_type, metadata)
+
     s3_client = get_s3_client()
 
     extra_args = {}
@@ -66,6 +118,7 @@ def upload_file(
     if metadata:
         extra_args["Metadata"] = metadata
 
+    _forget_exists(s3_key)
     try:
         s3_client.put_object(
             Bucket=S3_BUCKET,
@@ -73,18 +126,96 @@ def upload_file(
             Body=file_content,
             **extra_args,
         )
-
-        # Generate S3 URL
-        s3_url = f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
-        return s3_url
+        return get_file_url(s3_key)
 
     except ClientError as e:
         raise RuntimeError(f"Failed to upload file to S3: {e}") from e
 
 
+def upload_fileobj(
+    fileobj: BinaryIO,
+    s3_key: str,
+    content_type: str | None = None,
+    metadata: dict[str, str] | None = None,
+) -> str:
+    """
+    Stream a file-like object to S3.
+    Large objects are sent as a multipart upload, so only one part is held
+    in memory at a time.
+
+    Args:
+        fileobj: Readable binary file object positioned at the start of the data
+        s3_key: S3 object key (path) where file will be stored
+        content_type: MIME type of the file (e.g., 'image/jpeg', 'application/pdf')
+        metadata: Optional metadata dictionary to attach to the object
+
+    Returns:
+        S3 URL of the uploaded file
+
+    Raises:
+        RuntimeError: If upload fails
+    """
+    s3_client = get_s3_client()
+
+    extra_args = {}
+    if content_type:
+        extra_args["ContentType"] = content_type
+    if metadata:
+        extra_args["Metadata"] = metadata
+
+    _forget_exists(s3_key)
+    try:
+        s3_client.upload_fileobj(
+            fileobj,
+            S3_BUCKET,
+            s3_key,
+            ExtraArgs=extra_args,
+            Config=TRANSFER_CONFIG,
+        )
+        return get_file_url(s3_key)
+
+    except (ClientError, S3UploadFailedError) as e:
+        raise RuntimeError(f"Failed to upload file to S3: {e}") from e
+
+
+def generate_presigned_put_url(
+    s3_key: str,
+    content_type: str,
+    content_length: int,
+    expires_in: int = PRESIGNED_URL_EXPIRES_IN,
+) -> str:
+    """
+    Create a presigned URL the client can PUT the file to directly.
+    The declared content type (and, with SigV4 signing, the length) is part
+    of the signature, so S3 rejects a PUT whose headers do not match.
+
+    Args:
+        s3_key: S3 object key (path) the file will be stored under
+        content_type: MIME type the client must send as Content-Type
+        content_length: Exact size in bytes the client must send
+        expires_in: Seconds until the URL expires
+
+    Returns:
+        Presigned PUT URL
+    """
+    s3_client = get_s3_client()
+
+    return s3_client.generate_presigned_url(
+        "put_object",
+        Params={
+            "Bucket": S3_BUCKET,
+            "Key": s3_key,
+            "ContentType": content_type,
+            "ContentLength": content_length,
+        },
+        ExpiresIn=expires_in,
+    )
+
+
 def download_file(s3_key: str) -> bytes:
     """
     Download a file from S3.
+    Objects above the multipart threshold are fetched as parallel ranged GETs.
 
     Args:
         s3_key: S3 object key (path) of the file to download
@@ -97,13 +228,15 @@ def download_file(s3_key: str) -> bytes:
     """
     s3_client = get_s3_client()
 
+    buffer = io.BytesIO()
     try:
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
-        return response["Body"].read()
+        s3_client.download_fileobj(S3_BUCKET, s3_key, buffer, Config=TRANSFER_CONFIG)
+        return buffer.getvalue()
 
     except ClientError as e:
+        # The transfer manager's HEAD reports a missing key as a bare 404
         error_code = e.response.get("Error", {}).get("Code", "Unknown")
-        if error_code == "NoSuchKey":
+        if error_code in ("NoSuchKey", "404"):
             raise FileNotFoundError(f"File not found in S3: {s3_key}") from e
         raise RuntimeError(f"Failed to download file from S3: {e}") from e
 
@@ -120,6 +253,7 @@ def delete_file(s3_key: str) -> None:
     """
     s3_client = get_s3_client()
 
+    _forget_exists(s3_key)
     try:
         s3_client.delete_object(Bucket=S3_BUCKET, Key=s3_key)
 
@@ -130,6 +264,7 @@ def delete_file(s3_key: str) -> None:
 def file_exists(s3_key: str) -> bool:
     """
     Check if a file exists in S3.
+    Keys found in the last 30 seconds are answered without a request.
 
     Args:
         s3_key: S3 object key (path) to check
@@ -137,10 +272,16 @@ def file_exists(s3_key: str) -> bool:
     Returns:
         True if file exists, False otherwise
     """
+    with _exists_lock:
+        if s3_key in _exists_cache:
+            return True
+
     s3_client = get_s3_client()
 
     try:
         s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key)
+        with _exists_lock:
+            _exists_cache[s3_key] = True
         return True
     except ClientError as e:
         error_code = e.response.get("Error", {}).get("Code", "Unknown")
@@ -150,6 +291,12 @@ def file_exists(s3_key: str) -> bool:
         raise RuntimeError(f"Error checking file existence in S3: {e}") from e
 
 
+def _forget_exists(s3_key: str) -> None:
+    """Drop a cached file_exists hit for a key that is being overwritten or deleted."""
+    with _exists_lock:
+        _exists_cache.pop(s3_key, None)
+
+
 def get_file_url(s3_key: str) -> str:
     """
     Get the public URL for an S3 file.
@@ -162,3 +309,51 @@ def get_file_url(s3_key: str) -> str:
     """
     return f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
 
+
+def shutdown_executor() -> None:
+    """Wait for in-flight S3 calls and stop the worker threads."""
+    _s3_executor.shutdown(wait=True)
+
+
+async def _run_in_s3_executor(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(
+        _s3_executor, partial(func, *args, **kwargs)
+    )
+
+
+# Awaitable versions of the calls above for use on the event loop; the sync
+# functions stay for scripts such as test_s3.py
+
+async def upload_file_async(
+    file_content: bytes,
+    s3_key: str,
+    content_type: str | None = None,
+    metadata: dict[str, str] | None = None,
+) -> str:
+    """Async upload_file."""
+    return await _run_in_s3_executor(upload_file, file_content, s3_key, content_type, metadata)
+
+
+async def upload_fileobj_async(
+    fileobj: BinaryIO,
+    s3_key: str,
+    content_type: str | None = None,
+    metadata: dict[str, str] | None = None,
+) -> str:
+    """Async upload_fileobj."""
+    return await _run_in_s3_executor(upload_fileobj, fileobj, s3_key, content_type, metadata)
+
+
+async def download_file_async(s3_key: str) -> bytes:
+    """Async download_file."""
+    return await _run_in_s3_executor(download_file, s3_key)
+
+
+async def delete_file_async(s3_key: str) -> None:
+    """Async delete_file."""
+    await _run_in_s3_executor(delete_file, s3_key)
+
+
+async def file_exists_async(s3_key: str) -> bool:
+    """Async file_exists."""
+    return await _run_in_s3_executor(file_exists, s3_key)
@@ -12,16 +12,25 @@ CREATE TABLE IF NOT EXISTS files (
     filename VARCHAR(255) NOT NULL,
     file_type VARCHAR(10) NOT NULL, -- 'jpeg', 'png', 'pdf'
     file_size BIGINT NOT NULL,
+    sha256 CHAR(64), -- hex SHA-256 of the uploaded content
     s3_bucket VARCHAR(255),
     s3_key VARCHAR(512),
     s3_url TEXT,
     upload_status VARCHAR(20) DEFAULT 'pending', -- 'pending', 'uploading', 'completed', 'failed'
     extraction_status VARCHAR(20) DEFAULT 'pending', -- 'pending', 'processing', 'completed', 'failed'
+    extracted_text TEXT,
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Columns added after the initial release
+ALTER TABLE files ADD COLUMN IF NOT EXISTS sha256 CHAR(64);
+ALTER TABLE files ADD COLUMN IF NOT EXISTS extracted_text TEXT;
+
 CREATE INDEX IF NOT EXISTS idx_files_patient_id ON files(patient_id);
+-- Serves per-patient listings newest-first straight from the index
+CREATE INDEX IF NOT EXISTS idx_files_patient_created ON files(patient_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_files_patient_sha256 ON files(patient_id, sha256);
 CREATE INDEX IF NOT EXISTS idx_files_upload_status ON files(upload_status);
 
 -- Table to store generated summary PDFs
@@ -34,10 +43,30 @@ CREATE TABLE IF NOT EXISTS summary_pdfs (
     s3_url TEXT,
     status VARCHAR(20) DEFAULT 'processing', -- 'processing', 'completed', 'failed'
     file_ids INTEGER[], -- Array of file IDs used to generate this summary
+    content_hash CHAR(64), -- hex SHA-256 of the summary inputs; equal hashes mean an identical PDF
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+ALTER TABLE summary_pdfs ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
 CREATE INDEX IF NOT EXISTS idx_summary_pdfs_patient_id ON summary_pdfs(patient_id);
+CREATE INDEX IF NOT EXISTS idx_summary_pdfs_patient_hash ON summary_pdfs(patient_id, content_hash);
 CREATE INDEX IF NOT EXISTS idx_summary_pdfs_status ON summary_pdfs(status);
 
+-- Summaries pre-generated through the OpenAI Batch API, one row per patient per batch
+CREATE TABLE IF NOT EXISTS summaries (
+    id SERIAL PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    specialist_type VARCHAR(50) NOT NULL,
+    batch_id VARCHAR(128) NOT NULL,
+    status VARCHAR(20) DEFAULT 'pending', -- 'pending', 'completed', 'failed'
+    sources JSONB NOT NULL DEFAULT '[]', -- RAG sources the prompt was built from
+    result JSONB, -- summary result in the same shape as the online endpoint returns
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_summaries_batch_id ON summaries(batch_id);
+CREATE INDEX IF NOT EXISTS idx_summaries_patient_specialist ON summaries(patient_id, specialist_type, updated_at DESC);
+